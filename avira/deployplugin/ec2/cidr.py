@@ -0,0 +1,106 @@
+"""
+Allocation of free, aligned subnets inside a VPC's CIDR block.
+
+Addresses are handled as integers. The used ranges are kept as a sorted
+list of merged intervals, so finding the next free block only jumps over
+the intervals in the way (found by bisection) instead of testing every
+possible block.
+"""
+import bisect
+import socket
+import struct
+
+__all__ = ('parse_cidr', 'parse_prefix', 'subnet_prefix', 'format_cidr',
+           'CidrAllocator')
+
+# the subnet sizes EC2 accepts
+SUBNET_PREFIXES = (16, 28)
+
+
+def parse_cidr(cidr):
+    """ '10.0.1.0/24' -> (first address as int, prefix length) """
+    address, _, prefix = cidr.partition('/')
+    prefix = int(prefix) if prefix else 32
+    if not 0 <= prefix <= 32:
+        raise ValueError("invalid prefix length in %s" % cidr)
+    try:
+        network = struct.unpack('!I', socket.inet_aton(address))[0]
+    except socket.error:
+        raise ValueError("invalid address in %s" % cidr)
+    size = 1 << (32 - prefix)
+    return network & ~(size - 1) & 0xffffffff, prefix
+
+
+def parse_prefix(value):
+    """ '/24', '24' or 24 -> 24, ValueError outside of 0-32 """
+    try:
+        prefix = int(str(value).lstrip('/'))
+    except ValueError:
+        raise ValueError("invalid prefix length %s" % value)
+    if not 0 <= prefix <= 32:
+        raise ValueError("invalid prefix length %s" % value)
+    return prefix
+
+
+def subnet_prefix(value):
+    """ like parse_prefix, only for sizes EC2 accepts for a subnet """
+    prefix = parse_prefix(value)
+    low, high = SUBNET_PREFIXES
+    if not low <= prefix <= high:
+        raise ValueError("subnets must be between /%s and /%s, not /%s" %
+                         (low, high, prefix))
+    return prefix
+
+
+def format_cidr(network, prefix):
+    return "%s/%s" % (socket.inet_ntoa(struct.pack('!I', network)), prefix)
+
+
+def _align(address, size):
+    return (address + size - 1) & ~(size - 1)
+
+
+class CidrAllocator(object):
+    """ Hand out free blocks of a CIDR block, given the used ones """
+
+    def __init__(self, cidr_block, used=()):
+        network, prefix = parse_cidr(cidr_block)
+        self.start = network
+        self.end = network + (1 << (32 - prefix))
+        self.starts = []
+        self.ends = []
+        for cidr in used:
+            self.reserve(cidr)
+
+    def reserve(self, cidr):
+        """ mark a block as used """
+        network, prefix = parse_cidr(cidr)
+        start, end = network, network + (1 << (32 - prefix))
+        # merge with every interval it touches
+        index = bisect.bisect_left(self.ends, start)
+        last = index
+        while last < len(self.starts) and self.starts[last] <= end:
+            start = min(start, self.starts[last])
+            end = max(end, self.ends[last])
+            last += 1
+        self.starts[index:last] = [start]
+        self.ends[index:last] = [end]
+
+    def allocate(self, prefix):
+        """
+        Return the first free block of the prefix length, aligned to its
+        size, and mark it used. Raises ValueError when there is none.
+        """
+        prefix = parse_prefix(prefix)
+        size = 1 << (32 - prefix)
+        candidate = _align(self.start, size)
+        while candidate + size <= self.end:
+            # the first interval ending after the candidate starts
+            index = bisect.bisect_right(self.ends, candidate)
+            if index == len(self.starts) or \
+                    self.starts[index] >= candidate + size:
+                cidr = format_cidr(candidate, prefix)
+                self.reserve(cidr)
+                return cidr
+            candidate = _align(self.ends[index], size)
+        raise ValueError("no free /%s left" % prefix)
@@ -0,0 +1,139 @@
+"""
+Incremental parsing of DescribeInstances responses.
+
+boto reads the whole response and builds a full Reservation/Instance tree
+before returning anything. The handler below feeds the response to a SAX
+parser chunk by chunk, only picks the fields of an InstanceRecord and hands
+out every instance as soon as its element is closed.
+"""
+import xml.sax
+
+from avira.deployplugin.ec2.records import InstanceRecord
+
+__all__ = ('DescribeInstancesHandler', 'parse_chunks', 'iter_instances')
+
+CHUNK_SIZE = 16384
+
+# fields directly below an instance element, mapped to record arguments
+_FIELDS = {
+    'instanceId': 'id',
+    'imageId': 'image_id',
+    'instanceType': 'instance_type',
+    'keyName': 'key_name',
+    'dnsName': 'dns_name',
+    'subnetId': 'subnet_id',
+    'vpcId': 'vpc_id',
+    'privateIpAddress': 'private_ip_address',
+}
+
+
+class DescribeInstancesHandler(xml.sax.ContentHandler):
+    """
+    Collects InstanceRecords while a DescribeInstances response is parsed.
+    Finished records are picked up with ``drain``.
+    """
+
+    def __init__(self):
+        xml.sax.ContentHandler.__init__(self)
+        self.records = []
+        self.next_token = None
+        self._path = []
+        self._text = []
+        self._depth = None
+        self._fields = None
+        self._tags = None
+        self._tag = None
+
+    def drain(self):
+        records, self.records = self.records, []
+        return records
+
+    def startElement(self, name, attrs):
+        path = self._path
+        path.append(name)
+        self._text = []
+        if name == 'item' and self._depth is None and \
+                len(path) > 1 and path[-2] == 'instancesSet':
+            self._depth = len(path)
+            self._fields = {}
+            self._tags = {}
+
+    def characters(self, content):
+        self._text.append(content)
+
+    def endElement(self, name):
+        path = self._path
+        relative = len(path) - (self._depth or 0)
+        if self._depth is None:
+            if name == 'nextToken' and len(path) == 2:
+                self.next_token = ''.join(self._text).strip() or None
+        elif relative == 0:
+            self.records.append(InstanceRecord(tags=self._tags, **self._fields))
+            self._depth = None
+        elif relative == 1:
+            if name in _FIELDS:
+                # empty elements give '' like boto, missing ones stay None
+                self._fields[_FIELDS[name]] = ''.join(self._text).strip()
+        elif relative == 2:
+            parent = path[-2]
+            if parent == 'instanceState' and name == 'name':
+                self._fields['state'] = ''.join(self._text).strip()
+            elif parent == 'placement' and name == 'availabilityZone':
+                self._fields['placement'] = ''.join(self._text).strip()
+        elif relative == 3 and path[-3] == 'tagSet':
+            if name == 'key':
+                self._tag = ''.join(self._text).strip()
+            elif name == 'value':
+                self._tags[self._tag] = ''.join(self._text).strip()
+        self._text = []
+        path.pop()
+
+
+def parse_chunks(chunks, handler=None):
+    """
+    Feed an iterable of response chunks to the parser, yielding records
+    while the chunks come in.
+    """
+    handler = handler or DescribeInstancesHandler()
+    parser = xml.sax.make_parser()
+    parser.setContentHandler(handler)
+    for chunk in chunks:
+        parser.feed(chunk)
+        for record in handler.drain():
+            yield record
+    parser.close()
+    for record in handler.drain():
+        yield record
+
+
+def _read_chunks(response):
+    while True:
+        chunk = response.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def iter_instances(connection, instance_ids=None, filters=None):
+    """
+    Fast path for ``connection.get_all_instances``, yielding InstanceRecords
+    while the response is still being read. Follows nextToken pagination.
+    """
+    params = {}
+    if instance_ids:
+        connection.build_list_params(params, instance_ids, 'InstanceId')
+    if filters:
+        connection.build_filter_params(params, filters)
+    while True:
+        response = connection.make_request('DescribeInstances', params,
+                                           verb='POST')
+        if response.status != 200:
+            body = response.read()
+            raise connection.ResponseError(response.status, response.reason,
+                                           body)
+        handler = DescribeInstancesHandler()
+        for record in parse_chunks(_read_chunks(response), handler):
+            yield record
+        if not handler.next_token:
+            break
+        params['NextToken'] = handler.next_token
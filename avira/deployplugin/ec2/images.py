@@ -0,0 +1,86 @@
+"""
+A local index of AMIs, so deploy can take an image by name.
+
+The index is a list of images sorted by name and saved as json. Resolving
+``name:<pattern>[@latest|@oldest]`` only looks at the names sharing the
+pattern's literal prefix (found by bisection), so it does not need to
+describe images at all.
+"""
+import bisect
+import fnmatch
+import json
+import os
+import time
+
+__all__ = ('ImageIndex',)
+
+# fields of an entry, in order
+FIELDS = ('name', 'id', 'creation_date', 'owner_id', 'state')
+
+_WILDCARDS = '*?['
+
+
+class ImageIndex(object):
+    """ AMIs sorted by name """
+
+    def __init__(self, images, created=None):
+        self.images = sorted(tuple(i) for i in images)
+        self.names = [i[0] for i in self.images]
+        self.created = time.time() if created is None else created
+
+    @classmethod
+    def from_boto(cls, images):
+        return cls((i.name or '', i.id, i.creation_date or '', i.owner_id,
+                    i.state) for i in images)
+
+    @classmethod
+    def load(cls, path):
+        """ Load a saved index, None if there is none """
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['images'], data['created'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'created': self.created, 'images': self.images}, f)
+
+    def age(self):
+        return time.time() - self.created
+
+    def match(self, pattern):
+        """ entries whose name matches the (fnmatch) pattern """
+        prefix = pattern
+        for index, char in enumerate(pattern):
+            if char in _WILDCARDS:
+                prefix = pattern[:index]
+                break
+        start = bisect.bisect_left(self.names, prefix)
+        matches = []
+        for index in xrange(start, len(self.images)):
+            image = self.images[index]
+            if not image[0].startswith(prefix):
+                break
+            if fnmatch.fnmatchcase(image[0], pattern):
+                matches.append(image)
+        return matches
+
+    def resolve(self, spec):
+        """
+        Resolve ``name:<pattern>[@latest|@oldest]`` to an image id. Only
+        available images are considered, ``@latest`` is the default. Raises
+        KeyError when nothing matches.
+        """
+        pattern = spec[len('name:'):] if spec.startswith('name:') else spec
+        pick = 'latest'
+        if '@' in pattern:
+            pattern, pick = pattern.rsplit('@', 1)
+        if pick not in ('latest', 'oldest'):
+            raise KeyError("unknown image selection @%s" % pick)
+        images = [i for i in self.match(pattern) if i[4] == 'available']
+        if not images:
+            raise KeyError("no image matches %s" % pattern)
+        # creation dates are ISO 8601, so they sort as strings
+        images.sort(key=lambda i: i[2])
+        return images[-1][1] if pick == 'latest' else images[0][1]
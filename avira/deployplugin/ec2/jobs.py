@@ -0,0 +1,127 @@
+"""
+Background jobs for the interactive prompt.
+
+A job runs a command line on its own thread. Everything the command prints
+goes into the job's buffer instead of the terminal: sys.stdout is replaced
+by a proxy which writes to the buffer of the job running on the current
+thread, and to the real stdout for every other thread. Output external
+programs write directly to the terminal is not captured.
+"""
+import sys
+import threading
+import time
+from StringIO import StringIO
+
+__all__ = ('Job', 'JobManager')
+
+
+class ThreadStdout(object):
+    """ stdout which sends the output of job threads to their buffers """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, data):
+        buffer = getattr(self.local, 'buffer', None)
+        (buffer or self.stream).write(data)
+
+    def flush(self):
+        buffer = getattr(self.local, 'buffer', None)
+        (buffer or self.stream).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Job(object):
+    """ One command line running in the background """
+
+    def __init__(self, number, line):
+        self.number = number
+        self.line = line
+        self.output = StringIO()
+        self.started = time.time()
+        self.finished = None
+        self.error = None
+        self.notified = False
+        self.thread = None
+
+    @property
+    def status(self):
+        if self.finished is None:
+            return 'Running'
+        return 'Failed' if self.error is not None else 'Done'
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    def __str__(self):
+        return "[%s] %-8s %6.1fs  %s" % (self.number, self.status,
+                                         self.elapsed, self.line)
+
+
+class JobManager(object):
+    """ Start, list and wait for jobs """
+
+    def __init__(self):
+        self.jobs = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._stdout = None
+
+    def _install_stdout(self):
+        if not isinstance(sys.stdout, ThreadStdout):
+            sys.stdout = ThreadStdout(sys.stdout)
+        self._stdout = sys.stdout
+
+    def start(self, line, func):
+        """ run ``func(line)`` on a new thread, returns the Job """
+        self._install_stdout()
+        with self._lock:
+            self._count += 1
+            job = Job(self._count, line)
+            self.jobs[job.number] = job
+
+        def run():
+            self._stdout.local.buffer = job.output
+            try:
+                func(line)
+            except Exception, e:
+                job.error = e
+                print "%s: %s" % (e.__class__.__name__, e)
+            finally:
+                self._stdout.local.buffer = None
+                job.finished = time.time()
+
+        job.thread = threading.Thread(target=run, name='job-%s' % job.number)
+        job.thread.daemon = True
+        job.thread.start()
+        return job
+
+    def get(self, number=None):
+        """ a job by number, the latest one by default """
+        if number is None:
+            return self.jobs[max(self.jobs)] if self.jobs else None
+        try:
+            return self.jobs.get(int(number))
+        except ValueError:
+            return None
+
+    def wait(self, job):
+        # join with a timeout, so ctrl-c still works in the foreground
+        while job.thread.is_alive():
+            job.thread.join(0.5)
+        job.notified = True
+        return job
+
+    def finished(self):
+        """ finished jobs which were not reported yet """
+        done = []
+        for number in sorted(self.jobs):
+            job = self.jobs[number]
+            if job.finished is not None and not job.notified:
+                job.notified = True
+                done.append(job)
+        return done
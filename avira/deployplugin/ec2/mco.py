@@ -0,0 +1,44 @@
+"""
+Helpers for talking to the puppet agents through mcollective.
+
+The mcollective identity of a node is usually its FQDN (the puppet
+certname), while our instances are known by their Name tag, which is the
+short hostname. Both sides are compared on the lower cased short hostname.
+"""
+import re
+
+_FINISHED = re.compile(r'Finished processing (\d+) / \d+ hosts')
+
+__all__ = ('short_hostname', 'identity_filter', 'ping_replies',
+           'processed_hosts')
+
+
+def short_hostname(name):
+    """ 'Web1.eu-west-1.example.com' -> 'web1' """
+    return name.split('.', 1)[0].lower()
+
+
+def identity_filter(names):
+    """ an ``-I`` regex matching the nodes by their short hostname """
+    hosts = sorted(set(re.escape(short_hostname(n)) for n in names))
+    return '/^(%s)(\\..*)?$/' % '|'.join(hosts)
+
+
+def ping_replies(output):
+    """ short hostnames of the nodes which answered ``mco ping`` """
+    replies = set()
+    for line in output.splitlines():
+        fields = line.split()
+        # "<identity>   time=45.12 ms", the statistics footer has no time=
+        if len(fields) >= 2 and fields[1].startswith('time='):
+            replies.add(short_hostname(fields[0]))
+    return replies
+
+
+def processed_hosts(output):
+    """
+    Number of nodes which answered an agent request like ``puppetd
+    runonce``, 0 when none was discovered.
+    """
+    match = _FINISHED.search(output)
+    return int(match.group(1)) if match else 0
@@ -0,0 +1,260 @@
+"""
+A small staged worker pipeline.
+
+Every item moves independently through a list of stages. Each stage has
+its own pool of worker threads, so a slow stage (e.g. waiting for an
+instance to come up) does not hold back items that are already further
+down the line.
+"""
+import Queue
+import datetime
+import threading
+import time
+
+__all__ = ('Stage', 'Pipeline', 'RateLimiter', 'chunks', 'wave_size',
+           'prune_selection')
+
+_STOP = object()
+
+
+class StageStats(object):
+    """ Throughput and latency counters of a single stage """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.first_start = None
+        self.last_end = None
+        self._lock = threading.Lock()
+
+    def record(self, start, end, ok=True):
+        elapsed = end - start
+        with self._lock:
+            self.count += 1
+            if not ok:
+                self.errors += 1
+            self.total += elapsed
+            self.min = elapsed if self.min is None else min(self.min, elapsed)
+            self.max = elapsed if self.max is None else max(self.max, elapsed)
+            if self.first_start is None or start < self.first_start:
+                self.first_start = start
+            if self.last_end is None or end > self.last_end:
+                self.last_end = end
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def throughput(self):
+        """ items per second over the time the stage was busy """
+        if not self.count:
+            return 0.0
+        span = self.last_end - self.first_start
+        return self.count / span if span > 0 else float(self.count)
+
+    def __str__(self):
+        return "{0:<15}\t{1:<6}\t{2:<6}\t{3:<10.2f}\t{4:<10.2f}\t{5:<10.2f}\t{6:.2f}".format(
+            self.name, self.count, self.errors, self.min or 0.0,
+            self.mean, self.max or 0.0, self.throughput)
+
+
+class Stage(object):
+    """
+    One step of the pipeline.
+
+    ``func`` gets the value produced by the previous stage (or the item
+    itself for the first stage) and returns the value for the next one.
+    Raising an exception drops the item out of the pipeline.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.stats = StageStats(name)
+
+
+class Pipeline(object):
+    """
+    Run items through a list of stages.
+
+    ``run`` returns a list of ``(item, result, stage_name, error)`` tuples
+    in completion order. ``stage_name`` and ``error`` are None for items
+    which made it through every stage. ``on_done`` is called with the same
+    tuple from the calling thread as soon as an item finishes, so it can
+    safely print progress.
+
+    If the calling thread is interrupted (ctrl-c, or an exception raised by
+    ``on_done``) the items still waiting in the queues are dropped and no
+    stage is started for them anymore. Calls already in progress finish in
+    the background, their results are discarded.
+    """
+
+    def __init__(self, stages, on_done=None):
+        self.stages = stages
+        self.on_done = on_done
+
+    def _work(self, stage, inbox, outbox, done, cancel):
+        while True:
+            task = inbox.get()
+            if task is _STOP:
+                break
+            if cancel.is_set():
+                continue
+            item, value = task
+            start = time.time()
+            try:
+                value = stage.func(value)
+            except Exception, e:
+                stage.stats.record(start, time.time(), ok=False)
+                done.put((item, None, stage.name, e))
+            else:
+                stage.stats.record(start, time.time())
+                outbox.put((item, value))
+
+    def _collect(self, done, last):
+        # items which passed every stage end up in the last queue, failed
+        # ones in the done queue; merge both in completion order
+        while True:
+            task = last.get()
+            if task is _STOP:
+                break
+            item, value = task
+            done.put((item, value, None, None))
+
+    def run(self, items):
+        items = list(items)
+        queues = [Queue.Queue() for _ in range(len(self.stages) + 1)]
+        done = Queue.Queue()
+        cancel = threading.Event()
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                t = threading.Thread(target=self._work,
+                                     args=(stage, queues[index],
+                                           queues[index + 1], done,
+                                           cancel))
+                t.daemon = True
+                t.start()
+                threads.append(t)
+        collector = threading.Thread(target=self._collect,
+                                     args=(done, queues[-1]))
+        collector.daemon = True
+        collector.start()
+
+        for item in items:
+            queues[0].put((item, item))
+
+        results = []
+        try:
+            while len(results) < len(items):
+                # a timeout keeps the main thread responsive to ctrl-c
+                try:
+                    outcome = done.get(timeout=1)
+                except Queue.Empty:
+                    continue
+                results.append(outcome)
+                if self.on_done is not None:
+                    self.on_done(*outcome)
+        except:
+            # stop handing out work, the daemon threads are not joined so
+            # the interrupt is not held up by calls in progress
+            cancel.set()
+            for queue in queues:
+                _drain(queue)
+            raise
+        finally:
+            for index, stage in enumerate(self.stages):
+                for _ in range(stage.workers):
+                    queues[index].put(_STOP)
+            queues[-1].put(_STOP)
+        for t in threads + [collector]:
+            t.join()
+        return results
+
+    def report(self):
+        """ per-stage statistics as printable lines """
+        lines = ["{0:<15}\t{1:<6}\t{2:<6}\t{3:<10}\t{4:<10}\t{5:<10}\t{6}".format(
+            "Stage", "Done", "Failed", "Min (s)", "Mean (s)", "Max (s)", "Items/s")]
+        lines.extend(str(stage.stats) for stage in self.stages)
+        return lines
+
+
+def _drain(queue):
+    while True:
+        try:
+            queue.get_nowait()
+        except Queue.Empty:
+            return
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared by worker threads, ``wait`` blocks until the next
+    request may be sent.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+def chunks(items, size):
+    """ split a list into lists of at most ``size`` items """
+    size = int(size)
+    return [items[n:n + size] for n in range(0, len(items), size)]
+
+
+def wave_size(total, batch=None, pct=None):
+    """
+    Number of items per wave, from a fixed ``batch`` or a percentage like
+    ``25%`` of ``total``. At least one.
+    """
+    if pct is not None:
+        share = float(str(pct).rstrip('%')) / 100
+        return max(1, int(total * share))
+    return max(1, int(batch or 1))
+
+
+def prune_selection(snapshots, keep=None, days=None, now=None):
+    """
+    The snapshots to delete: per volume all but the ``keep`` newest, and of
+    those only the ones older than ``days``. ``now`` is a UTC datetime.
+    """
+    cutoff = None
+    if days is not None:
+        now = now or datetime.datetime.utcnow()
+        cutoff = (now - datetime.timedelta(days=int(days))).strftime('%Y-%m-%dT%H:%M:%S')
+    by_volume = {}
+    for snap in snapshots:
+        by_volume.setdefault(snap.volume_id, []).append(snap)
+    doomed = []
+    for volume_id, snaps in sorted(by_volume.items()):
+        # start times are ISO 8601, newest first
+        snaps.sort(key=lambda snap: snap.start_time, reverse=True)
+        candidates = snaps[int(keep):] if keep is not None else snaps
+        doomed.extend(snap for snap in candidates
+                      if cutoff is None or snap.start_time < cutoff)
+    return doomed
@@ -0,0 +1,105 @@
+"""
+cProfile helpers for the ``profile`` command and ``AVIRA_EC2_PROFILE``.
+
+Besides the usual top functions by cumulative time, the report splits the
+time spent in the provider into a few buckets, so it is easy to see if a
+command is slow because of the network, XML parsing, the external helper
+programs or printing.
+"""
+import atexit
+import cProfile
+import os
+import pstats
+import sys
+
+__all__ = ('profile_call', 'print_report', 'categorize', 'profile_session')
+
+ENV_VARIABLE = 'AVIRA_EC2_PROFILE'
+
+# (category, substrings of the file or builtin name), first match wins
+CATEGORIES = (
+    ('xml parsing', ('xml/sax', 'xml/dom', 'expat', 'boto/handler.py',
+                     'boto/resultset.py', 'ec2/describe.py',
+                     '<built-in method Parse>')),
+    ('boto network', ('httplib', 'socket', 'ssl', 'boto/connection.py',
+                      'boto/auth.py', 'boto/https_connection.py')),
+    ('subprocess', ('subprocess', 'avira/deploy/clean', 'avira/deploy/utils',
+                    'avira/deploy/certificate', 'posix.', 'fork', 'waitpid')),
+    ('rendering', ('pprint', 'avira/deploy/pretty', "'format' of",
+                   "'write' of", 'StringIO')),
+)
+
+
+def profile_call(func, *args, **kwargs):
+    """ Run ``func`` under cProfile, returns the result and the profiler """
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.create_stats()
+    return result, profiler
+
+
+def _category(filename, funcname):
+    # builtins have '~' as their filename, their name tells what they are
+    name = funcname if filename == '~' else filename
+    for category, patterns in CATEGORIES:
+        for pattern in patterns:
+            if pattern in name:
+                return category
+    return 'other'
+
+
+def categorize(stats):
+    """
+    Sum the own time of every function per category. ``stats`` is a
+    ``pstats.Stats`` instance, returns a dict of category -> seconds.
+    """
+    totals = dict((c, 0.0) for c, _ in CATEGORIES)
+    totals['other'] = 0.0
+    for (filename, _, funcname), (_, _, tottime, _, _) in stats.stats.items():
+        totals[_category(filename, funcname)] += tottime
+    return totals
+
+
+def print_report(profiler, limit=20, path=None, stream=None):
+    """
+    Print the top ``limit`` functions by cumulative time and the time per
+    category. The raw stats are written to ``path`` when given.
+    """
+    stream = stream or sys.stdout
+    if path:
+        profiler.dump_stats(path)
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(int(limit))
+
+    totals = categorize(stats)
+    overall = sum(totals.values()) or 1.0
+    print >> stream, "{0:<15}\t{1:<10}\t{2}".format("Category", "Time (s)", "Share")
+    for category, seconds in sorted(totals.items(), key=lambda t: -t[1]):
+        print >> stream, "{0:<15}\t{1:<10.3f}\t{2:.1%}".format(
+            category, seconds, seconds / overall)
+    if path:
+        print >> stream, "profile written to %s" % path
+
+
+def profile_session():
+    """
+    Profile the rest of the session when ``AVIRA_EC2_PROFILE`` is set and
+    print the report on exit. Any value other than ``1`` is used as the
+    path of the ``.pstats`` file.
+    """
+    value = os.environ.get(ENV_VARIABLE)
+    if not value:
+        return None
+    path = None if value == '1' else value
+    profiler = cProfile.Profile()
+
+    def report():
+        profiler.disable()
+        profiler.create_stats()
+        print_report(profiler, path=path)
+
+    atexit.register(report)
+    profiler.enable()
+    return profiler
@@ -1,20 +1,60 @@
-import subprocess
-
-import boto.ec2
-import boto.vpc
-
-from avira.deploy import api, pretty
-from avira.deploy.clean import run_machine_cleanup, \
-    remove_machine_port_forwards, node_clean, clean_foreman
-from avira.deploy.userdata import UserData
-from avira.deploy.utils import find_by_key, \
-    find_machine, wrap, sort_by_key, is_puppetmaster, check_call_with_timeout
-from avira.deploy.certificate import add_pending_certificate
+import os
+import time
+
+from avira.deploy import api
 from avira.deploy.config import cfg
 
 __all__ = ('Provider',)
 
-import pprint
+# Everything else is imported by the commands which need it, so loading the
+# plugin (e.g. for its config template) stays cheap. See
+# benchmarks/import_time.py.
+
+# seconds between and the maximum time of polls for a machine to come up
+WAIT_INTERVAL = 5
+WAIT_TIMEOUT = 600
+
+# seconds to wait after rebooting a wave before checking its health, and
+# the maximum time a wave may take to become healthy again
+REBOOT_GRACE = 30
+WAVE_TIMEOUT = 900
+
+# maximum time for the puppet agent of a new machine to answer mco
+AGENT_TIMEOUT = 900
+
+# seconds before the cached inventory is fetched again
+INVENTORY_TTL = 60
+
+# the local AMI index used to deploy images by name, and its maximum age
+IMAGE_INDEX = os.path.expanduser('~/.avira-deploy-ec2-images.json')
+IMAGE_INDEX_TTL = 3600
+
+# requests per second bulk commands may send, the number of threads they
+# use and the maximum number of resources per CreateTags/DeleteTags request
+API_RATE = 10
+BULK_WORKERS = 4
+TAG_CHUNK = 1000
+
+# threads fetching console output, and the lines `console grep=True` reports
+CONSOLE_WORKERS = 10
+CONSOLE_ERRORS = (r'Traceback|cloud-init.*(ERROR|WARN|[Ff]ail)|'
+                  r'^err: |Error: |Could not retrieve catalog|'
+                  r'[Ff]ailed to |puppet.*(error|failed)')
+
+# resources a command changes, forgotten by the caches after it ran
+STALE_AFTER = {
+    'deploy': ('instances', 'volumes'),
+    'provision': ('instances', 'volumes'),
+    'destroy': ('instances', 'volumes', 'addresses'),
+    'start': ('instances',),
+    'stop': ('instances',),
+    'reboot': ('instances',),
+    'rolling_reboot': ('instances',),
+    'request': ('addresses',),
+    'release': ('addresses',),
+    'vpc': ('subnets',),
+}
+
 
 class Provider(api.CmdApi):
     """ EC2 Deployment CMD Provider """
@@ -22,6 +62,27 @@ class Provider(api.CmdApi):
     prompt = "\033[92mec2>\033[0m "
 
     def __init__(self):
+        if os.environ.get('AVIRA_EC2_PROFILE'):
+            from avira.deployplugin.ec2.profiling import profile_session
+            profile_session()
+        if os.environ.get('AVIRA_EC2_TRACE'):
+            from avira.deployplugin.ec2.tracing import enable
+            enable(os.environ['AVIRA_EC2_TRACE'])
+
+        self.client, self.vpc = self._connect()
+        self._inventory = None
+        self._inventory_version = None
+        self._refresher = None
+        self._image_index = None
+        self._rate_limiter = None
+        self._jobs = None
+        api.CmdApi.__init__(self)
+
+    def _connect(self):
+        """ Open a new pair of EC2 and VPC connections """
+        import boto.ec2
+        import boto.vpc
+
         region = None
 
         for r in boto.ec2.regions(aws_access_key_id=cfg.ACCESSKEY,
@@ -31,16 +92,667 @@ class Provider(api.CmdApi):
                 region = r
                 break
 
-        self.client = boto.ec2.connect_to_region(cfg.REGION,
-                                                 aws_access_key_id=cfg.ACCESSKEY,
-                                                 aws_secret_access_key=cfg.SECRETKEY,
-                                                 debug=2)
+        client = boto.ec2.connect_to_region(cfg.REGION,
+                                            aws_access_key_id=cfg.ACCESSKEY,
+                                            aws_secret_access_key=cfg.SECRETKEY,
+                                            debug=2)
+
+        vpc = boto.vpc.VPCConnection(region=region,
+                                     aws_access_key_id=cfg.ACCESSKEY,
+                                     aws_secret_access_key=cfg.SECRETKEY,
+                                     debug=2)
+        if os.environ.get('AVIRA_EC2_RECORD') or \
+                os.environ.get('AVIRA_EC2_REPLAY'):
+            from avira.deployplugin.ec2.transport import wrap_connections
+            client, vpc = wrap_connections(client, vpc)
+        return client, vpc
+
+    def precmd(self, line):
+        if self._refresher is not None:
+            self._refresher.touch()
+        if self._jobs is not None:
+            for job in self._jobs.finished():
+                print job
+        return api.CmdApi.precmd(self, line)
+
+    def onecmd(self, line):
+        # "<command> &" and "bg <command>" run the command as a job
+        stripped = line.strip()
+        if stripped.endswith('&'):
+            return self._background(stripped[:-1].strip())
+        if stripped.startswith('bg '):
+            return self._background(stripped[3:].strip())
+        return self._run(line)
+
+    def _run(self, line):
+        stop = api.CmdApi.onecmd(self, line)
+        command, arg, _ = self.parseline(line)
+        if command == 'profile' and arg:
+            command = arg.split()[0]
+        self._invalidate(*STALE_AFTER.get(command, ()))
+        return stop
+
+    def _invalidate(self, *resources):
+        """ forget cached resources a command changed """
+        if not resources:
+            return
+        if 'instances' in resources or 'volumes' in resources:
+            self._inventory = None
+        if self._snapshot() is not None:
+            self._refresher.invalidate(*resources)
+
+    def _background(self, line):
+        from avira.deployplugin.ec2.jobs import JobManager
+
+        if not line:
+            return False
+        if self._jobs is None:
+            self._jobs = JobManager()
+        job = self._jobs.start(line, self._run)
+        print "[%s] %s" % (job.number, line)
+        return False
+
+    def _snapshot(self):
+        """
+        The current snapshot of the background refresher, None if it does
+        not run. Read it once per command, the refresher swaps it.
+        """
+        if self._refresher is None or not self._refresher.is_alive():
+            return None
+        return self._refresher.snapshot
 
-        self.vpc = boto.vpc.VPCConnection(region=region,
-                                          aws_access_key_id=cfg.ACCESSKEY,
-                                          aws_secret_access_key=cfg.SECRETKEY,
-                                          debug=2)
-        api.CmdApi.__init__(self)
+    def _cached(self, resource, fetch):
+        """ resources from the refresher snapshot, or ``fetch()`` them """
+        snapshot = self._snapshot()
+        items = snapshot.get(resource) if snapshot is not None else None
+        return fetch() if items is None else items
+
+    def get_inventory(self, refresh=False):
+        """
+        Return the cached inventory snapshot, fetching it again when it is
+        older than INVENTORY_TTL or ``refresh`` is set.
+        """
+        from avira.deployplugin.ec2.describe import iter_instances
+        from avira.deployplugin.ec2.inventory import Inventory
+
+        snapshot = self._snapshot()
+        if not refresh and snapshot is not None and \
+                snapshot.get('instances') is not None and \
+                snapshot.get('volumes') is not None:
+            if self._inventory is None or \
+                    self._inventory_version != snapshot.version:
+                self._inventory = Inventory.from_instances(
+                    snapshot.get('instances'), snapshot.get('volumes'))
+                self._inventory_version = snapshot.version
+            return self._inventory
+
+        if refresh or self._inventory is None or \
+                self._inventory.age() > INVENTORY_TTL:
+            instances = list(iter_instances(self.client))
+            self._inventory = Inventory.from_instances(
+                instances, self.client.get_all_volumes())
+            self._inventory_version = None
+        return self._inventory
+
+    def do_refresher(self, action='status', **intervals):
+        """
+        Keep instances, volumes, subnets and elastic ips fresh in the
+        background, so commands can answer from a warm snapshot. Polling
+        pauses while the prompt is idle.
+
+        Usage::
+
+            ec2> refresher start [instances=30 volumes=120 addresses=120 subnets=600]
+            ec2> refresher status
+            ec2> refresher stop
+
+        The optional values are refresh intervals in seconds.
+        """
+        from avira.deployplugin.ec2.refresher import InventoryRefresher
+
+        running = self._refresher is not None and self._refresher.is_alive()
+        if action == 'start':
+            if running:
+                print "refresher is already running"
+                return
+            intervals = dict((k, int(v)) for k, v in intervals.items())
+            self._refresher = InventoryRefresher(self._connect, intervals)
+            self._refresher.start()
+            print "refresher started"
+        elif action == 'stop':
+            if running:
+                self._refresher.stop()
+            self._refresher = None
+            print "refresher stopped"
+        elif action == 'status':
+            if not running:
+                print "refresher is not running"
+                return
+            snapshot = self._refresher.snapshot
+            print "{0:<15}\t{1:<10}\t{2}".format("Resource", "Items", "Age (s)")
+            for resource in sorted(self._refresher.intervals):
+                items = snapshot.get(resource)
+                print "{0:<15}\t{1:<10}\t{2}".format(resource,
+                    "-" if items is None else len(items),
+                    "-" if items is None else int(snapshot.age(resource)))
+            if self._refresher.idle:
+                print "idle, paused until the next command"
+            if self._refresher.last_error is not None:
+                print "%s errors, last: %s" % (self._refresher.errors,
+                                               self._refresher.last_error)
+        else:
+            print "Not implemented"
+
+    def _image_owners(self):
+        # accounts whose images are indexed, a comma separated config value
+        return getattr(cfg, 'IMAGE_OWNERS', 'self').split(',')
+
+    def get_image_index(self, refresh=False):
+        """
+        Return the local AMI index, describing the images of
+        ``_image_owners`` again when it is older than IMAGE_INDEX_TTL.
+        """
+        from avira.deployplugin.ec2.images import ImageIndex
+
+        index = None if refresh else self._image_index
+        if index is None and not refresh:
+            index = ImageIndex.load(IMAGE_INDEX)
+        if index is None or index.age() > IMAGE_INDEX_TTL:
+            index = ImageIndex.from_boto(
+                self.client.get_all_images(owners=self._image_owners()))
+            index.save(IMAGE_INDEX)
+        self._image_index = index
+        return index
+
+    def _resolve_ami(self, ami):
+        """ image id for ``ami``, which may be name:<pattern>[@latest] """
+        if not ami.startswith('name:'):
+            return ami
+        return self.get_image_index().resolve(ami)
+
+    def _bulk(self, name, func, items, workers=BULK_WORKERS, on_done=None):
+        """
+        Run ``func`` for every item on a pool of threads, sharing one rate
+        limit for all bulk commands. Returns the Pipeline results,
+        ``on_done`` is called as soon as an item is done.
+        """
+        from avira.deployplugin.ec2.pipeline import Stage, Pipeline, \
+            RateLimiter
+
+        if self._rate_limiter is None:
+            self._rate_limiter = RateLimiter(API_RATE)
+        limiter = self._rate_limiter
+
+        def call(item):
+            limiter.wait()
+            return func(item)
+
+        return Pipeline([Stage(name, call, workers)], on_done).run(items)
+
+    def _select_resources(self, args, criteria):
+        """
+        Resource ids from explicit ids plus the instances matching the
+        selector criteria.
+        """
+        from avira.deployplugin.ec2.describe import iter_instances
+        from avira.deployplugin.ec2.selector import instance_selector
+
+        resource_ids = list(args)
+        if criteria:
+            _, filters = instance_selector([], criteria)
+            resource_ids.extend(r.id for r in
+                                iter_instances(self.client, filters=filters))
+        return resource_ids
+
+    def _update_local_tags(self, resource_ids, tags=None, remove=()):
+        # keep the inventory and the refresher snapshot in line with EC2
+        if self._inventory is not None:
+            self._inventory.update_tags(resource_ids, tags, remove)
+        if self._snapshot() is not None:
+            self._refresher.update_tags(resource_ids, tags, remove)
+
+    def _tag_resources(self, resource_ids, tags=None, remove=()):
+        from avira.deployplugin.ec2.pipeline import chunks
+
+        if remove:
+            keys = dict((key, None) for key in remove)
+            func = lambda ids: self.client.delete_tags(ids, keys)
+        else:
+            func = lambda ids: self.client.create_tags(ids, tags)
+
+        done = []
+        for batch, _, _, error in self._bulk('tag', func,
+                                             chunks(resource_ids, TAG_CHUNK)):
+            if error is None:
+                done.extend(batch)
+            else:
+                print "tagging %s .. %s failed: %s" % (batch[0], batch[-1], error)
+        self._update_local_tags(done, tags, remove)
+        return done
+
+    def do_tag(self, *args, **kwargs):
+        """
+        Set tags on instances, volumes and elastic ips.
+
+        Usage::
+
+            ec2> tag <resource ids|selector> Key=Value [Key=Value ...]
+
+        Resources are given by id (i-, vol-, eipalloc- ...) and/or by an
+        instance selector (name=web* tag:Role=lvs state=running vpc-id=..),
+        all other Key=Value arguments are the tags to set, e.g. to rename a
+        role::
+
+            ec2> tag tag:Role=www Role=web
+
+        The resources are tagged in batches of TAG_CHUNK, several batches at
+        a time.
+        """
+        from avira.deployplugin.ec2.selector import split_criteria, \
+            is_resource_id
+
+        criteria, tags = split_criteria(kwargs)
+        invalid = [a for a in args if not is_resource_id(a)]
+        if invalid:
+            print "%s is not a resource id" % invalid[0]
+            return
+        if not tags or not (args or criteria):
+            print "Specify the resources and at least one Key=Value tag"
+            return
+        resource_ids = self._select_resources(args, criteria)
+        done = self._tag_resources(resource_ids, tags=tags)
+        print "tagged %s of %s resources" % (len(done), len(resource_ids))
+
+    def do_untag(self, *args, **criteria):
+        """
+        Remove tags from instances, volumes and elastic ips.
+
+        Usage::
+
+            ec2> untag <resource ids|selector> Key [Key ...]
+
+        Resources are selected like for ``tag``, the other arguments are the
+        keys of the tags to remove::
+
+            ec2> untag tag:Role=web Environment
+        """
+        from avira.deployplugin.ec2.selector import is_resource_id
+
+        resource_ids = [a for a in args if is_resource_id(a)]
+        keys = [a for a in args if not is_resource_id(a)]
+        if not keys or not (resource_ids or criteria):
+            print "Specify the resources and at least one tag key"
+            return
+        resource_ids = self._select_resources(resource_ids, criteria)
+        done = self._tag_resources(resource_ids, remove=keys)
+        print "untagged %s of %s resources" % (len(done), len(resource_ids))
+
+    def do_console(self, *args, **kwargs):
+        """
+        Fetch the console output of many instances at once, e.g. to debug
+        failed cloud-init or puppet runs. Every output is written to
+        <out_dir>/<instance_id>.log as soon as it arrives.
+
+        Usage::
+
+            ec2> console <selector> [out_dir=console] [grep=True] [pattern=<regex>]
+
+        The selector is a list of instance ids and/or filters like name=web*
+        tag:Role=lvs state=running. With grep=True the outputs are searched
+        for cloud-init and puppet errors in the same pass, pattern=<regex>
+        searches for something else::
+
+            ec2> console tag:Role=web grep=True
+        """
+        import errno
+        import re
+        from avira.deployplugin.ec2.describe import iter_instances
+        from avira.deployplugin.ec2.selector import instance_selector
+
+        out_dir = kwargs.pop('out_dir', 'console')
+        pattern = kwargs.pop('pattern', None)
+        if kwargs.pop('grep', False) and pattern is None:
+            pattern = CONSOLE_ERRORS
+        try:
+            instance_ids, filters = instance_selector(args, kwargs)
+        except ValueError, e:
+            print e
+            return
+        if not (instance_ids or filters):
+            print "Specify the instances"
+            return
+        if filters:
+            instance_ids = [r.id for r in iter_instances(
+                self.client, instance_ids=instance_ids, filters=filters)]
+        regex = re.compile(pattern, re.MULTILINE) if pattern else None
+
+        try:
+            os.makedirs(out_dir)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        def on_done(instance_id, console, stage, error):
+            if error is not None:
+                print "%s: %s" % (instance_id, error)
+                return
+            output = console.output or ''
+            path = os.path.join(out_dir, "%s.log" % instance_id)
+            with open(path, 'w') as f:
+                f.write(output)
+            if regex is None:
+                print "%s: %s bytes written to %s" % (instance_id, len(output), path)
+                return
+            for line in output.splitlines():
+                if regex.search(line):
+                    print "%s: %s" % (instance_id, line)
+
+        results = self._bulk('console', self.client.get_console_output,
+                             instance_ids, CONSOLE_WORKERS, on_done)
+        failed = len([r for r in results if r[3] is not None])
+        print "fetched %s console outputs to %s, %s failed" % (
+            len(results) - failed, out_dir, failed)
+
+    def _select_volumes(self, args, criteria):
+        """
+        Volume ids from explicit vol- ids plus the volumes attached to the
+        selected instances.
+        """
+        from avira.deployplugin.ec2.describe import iter_instances
+        from avira.deployplugin.ec2.selector import instance_selector
+
+        volume_ids = [a for a in args if a.startswith('vol-')]
+        instance_ids, filters = instance_selector(
+            [a for a in args if not a.startswith('vol-')], criteria)
+        if filters:
+            instance_ids = [r.id for r in iter_instances(
+                self.client, instance_ids=instance_ids, filters=filters)]
+        if instance_ids:
+            volumes = self.client.get_all_volumes(
+                filters={'attachment.instance-id': instance_ids})
+            volume_ids.extend(v.id for v in volumes)
+        return volume_ids
+
+    def _wait_for_snapshots(self, snapshot_ids, interval=WAIT_INTERVAL):
+        """
+        Print the progress of pending snapshots until they are done, with
+        one describe for all of them per interval.
+        """
+        pending = set(snapshot_ids)
+        progress = {}
+        while pending:
+            for snap in self.client.get_all_snapshots(snapshot_ids=list(pending)):
+                if progress.get(snap.id) != (snap.status, snap.progress):
+                    progress[snap.id] = (snap.status, snap.progress)
+                    print "%s\t%s\t%s\t%s" % (time.strftime('%H:%M:%S'),
+                                              snap.id, snap.status,
+                                              snap.progress or '')
+                if snap.status != 'pending':
+                    pending.discard(snap.id)
+            if pending:
+                time.sleep(interval)
+
+    def _prune_snapshots(self, volume_ids, keep=None, days=None):
+        from avira.deployplugin.ec2.pipeline import prune_selection
+
+        if keep is None and days is None:
+            print "Specify keep=<count> and/or days=<age> to prune"
+            return
+        snapshots = self.client.get_all_snapshots(
+            owner='self', filters={'volume-id': volume_ids,
+                                   'status': 'completed'})
+        doomed = [snap.id for snap in prune_selection(snapshots, keep, days)]
+
+        results = self._bulk('delete', self.client.delete_snapshot, doomed)
+        for snapshot_id, _, _, error in results:
+            if error is not None:
+                print "deleting %s failed: %s" % (snapshot_id, error)
+        print "deleted %s of %s snapshots" % (
+            len([r for r in results if r[3] is None]), len(doomed))
+
+    def do_snapshot(self, *args, **kwargs):
+        """
+        Snapshot EBS volumes, all at once.
+
+        Usage::
+
+            ec2> snapshot <volume ids|instance selector> [description=..] [wait=True] [Key=Value ...]
+            ec2> snapshot prune <volume ids|instance selector> [keep=<count>] [days=<age>]
+
+        Volumes are given by id, or as the volumes attached to instances
+        selected by id or filters (name=web* tag:Role=db ...). Other
+        Key=Value arguments are tags for the new snapshots. wait=True
+        follows the progress of all snapshots until they are completed::
+
+            ec2> snapshot tag:Role=db Backup=daily wait=True
+
+        prune deletes the completed snapshots of the volumes except the
+        newest <count> ones and/or the ones younger than <age> days::
+
+            ec2> snapshot prune tag:Role=db keep=7
+        """
+        from avira.deployplugin.ec2.selector import split_criteria
+
+        prune = bool(args) and args[0] == 'prune'
+        if prune:
+            args = args[1:]
+        wait = kwargs.pop('wait', False)
+        description = kwargs.pop('description', '')
+        keep = kwargs.pop('keep', None)
+        days = kwargs.pop('days', None)
+        criteria, tags = split_criteria(kwargs)
+        try:
+            volume_ids = self._select_volumes(args, criteria)
+        except ValueError, e:
+            print e
+            return
+        if not volume_ids:
+            print "No volumes selected"
+            return
+
+        if prune:
+            self._prune_snapshots(volume_ids, keep, days)
+            return
+
+        snapshot_ids = []
+        create = lambda volume_id: self.client.create_snapshot(volume_id,
+                                                               description)
+        for volume_id, snap, _, error in self._bulk('snapshot', create, volume_ids):
+            if error is None:
+                print "%s: snapshot %s started" % (volume_id, snap.id)
+                snapshot_ids.append(snap.id)
+            else:
+                print "%s: snapshot failed: %s" % (volume_id, error)
+        if tags and snapshot_ids:
+            self._tag_resources(snapshot_ids, tags=tags)
+        if wait:
+            self._wait_for_snapshots(snapshot_ids)
+
+    def do_sg(self, action, path=None, dry_run=False):
+        """
+        Security group operations.
+
+        Usage::
+
+            ec2> sg sync <rules.json> [dry_run=True]
+
+        sync compares the ingress and egress rules in the file with the
+        current rules of each group and only authorizes and revokes the
+        difference, one request per group, direction and action. New rules
+        are authorized before old ones are revoked. With dry_run=True the
+        changes are only printed. The file format is described in
+        avira.deployplugin.ec2.secgroups.
+        """
+        from avira.deployplugin.ec2 import secgroups
+
+        if action != "sync" or path is None:
+            print "Not implemented"
+            return
+        try:
+            desired = secgroups.load_desired(path)
+        except (IOError, ValueError), e:
+            print "couldn't read %s: %s" % (path, e)
+            return
+
+        groups = {}
+        for group in self.client.get_all_security_groups():
+            groups[group.id] = group
+            groups.setdefault(group.name, []).append(group)
+
+        changes = []
+        for name, directions in sorted(desired.items()):
+            group = groups.get(name)
+            if isinstance(group, list):
+                if len(group) > 1:
+                    print "%s is ambiguous, use the group id" % name
+                    continue
+                group = group[0]
+            if group is None:
+                print "security group %s not found" % name
+                continue
+            for direction, wanted in sorted(directions.items()):
+                permissions = group.rules if direction == 'ingress' else group.rules_egress
+                authorize, revoke = secgroups.diff(
+                    secgroups.current_rules(permissions), wanted)
+                suffix = 'Ingress' if direction == 'ingress' else 'Egress'
+                for sign, rules in (('+', authorize), ('-', revoke)):
+                    for rule in sorted(rules):
+                        print "%s %s %s %s %s-%s %s" % (sign, group.id, direction,
+                                                        rule[0], rule[1] or '',
+                                                        rule[2] or '', rule[3])
+                if authorize:
+                    changes.append((group.id, 'AuthorizeSecurityGroup' + suffix, authorize))
+                if revoke:
+                    changes.append((group.id, 'RevokeSecurityGroup' + suffix, revoke))
+
+        if not changes:
+            print "security groups are in sync"
+            return
+        if dry_run:
+            print "dry run, %s requests not sent" % len(changes)
+            return
+
+        def apply(group_changes):
+            # authorize before revoke, so there is no window without access
+            for group_id, request, rules in group_changes:
+                params = secgroups.permission_params(rules)
+                params['GroupId'] = group_id
+                self.client.get_status(request, params, verb='POST')
+
+        by_group = {}
+        for change in changes:
+            by_group.setdefault(change[0], []).append(change)
+        for group_changes, _, _, error in self._bulk('sg', apply, by_group.values()):
+            if error is not None:
+                print "syncing %s failed: %s" % (group_changes[0][0], error)
+        print "sent %s requests" % len(changes)
+
+    def _mco_ping(self, names):
+        """ short hostnames of the named nodes which answer ``mco ping`` """
+        import subprocess
+        from avira.deployplugin.ec2.mco import identity_filter, ping_replies
+
+        command = ['mco', 'ping', '-I', identity_filter(names)]
+        try:
+            output = subprocess.check_output(command, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError, e:
+            output = e.output
+        return ping_replies(output)
+
+    def _wait_for_agent(self, name, timeout=AGENT_TIMEOUT):
+        """ wait until the puppet agent of a new machine answers mco """
+        from avira.deployplugin.ec2.mco import short_hostname
+
+        deadline = time.time() + timeout
+        while short_hostname(name) not in self._mco_ping([name]):
+            if time.time() > deadline:
+                raise RuntimeError("puppet agent on %s not answering after %ss" % (name, timeout))
+            time.sleep(WAIT_INTERVAL)
+
+    def _unhealthy(self, records, mco=False):
+        """
+        Instances of a wave which are not healthy yet. One status call
+        covers the whole wave, one ``mco ping`` checks the puppet agents.
+        """
+        statuses = dict((s.id, s) for s in self.client.get_all_instance_status(
+            instance_ids=[r.id for r in records], include_all_instances=True))
+        unhealthy = set()
+        for r in records:
+            status = statuses.get(r.id)
+            if status is None or status.state_name != 'running' or \
+                    status.system_status.status != 'ok' or \
+                    status.instance_status.status != 'ok':
+                unhealthy.add(r.id)
+        if mco and len(unhealthy) < len(records):
+            from avira.deployplugin.ec2.mco import short_hostname
+
+            answered = self._mco_ping([r.name for r in records])
+            unhealthy.update(r.id for r in records
+                             if short_hostname(r.name) not in answered)
+        return unhealthy
+
+    def do_rolling_reboot(self, *args, **kwargs):
+        """
+        Reboot instances in waves, waiting for every wave to be healthy
+        again before the next one starts. Stops at the first wave which
+        does not come back.
+
+        Usage::
+
+            ec2> rolling_reboot <selector> batch=<n>|pct=<percentage> [mco=True]
+                    optional: grace=30 timeout=900
+
+        The selector is a list of instance ids and/or filters like name=web*
+        tag:Role=lvs. A wave is healthy when EC2 reports both status checks
+        as ok, and with mco=True also all its puppet agents answer a ping::
+
+            ec2> rolling_reboot tag:Role=web pct=25% mco=True
+        """
+        from avira.deployplugin.ec2.describe import iter_instances
+        from avira.deployplugin.ec2.pipeline import chunks, wave_size
+        from avira.deployplugin.ec2.selector import instance_selector
+
+        batch = kwargs.pop('batch', None)
+        pct = kwargs.pop('pct', None)
+        mco = kwargs.pop('mco', False)
+        grace = float(kwargs.pop('grace', REBOOT_GRACE))
+        timeout = float(kwargs.pop('timeout', WAVE_TIMEOUT))
+        try:
+            instance_ids, filters = instance_selector(args, kwargs)
+        except ValueError, e:
+            print e
+            return
+        if not (instance_ids or filters):
+            print "Specify the instances"
+            return
+        if filters is None:
+            filters = {}
+        filters.setdefault('instance-state-name', 'running')
+        records = sorted(iter_instances(self.client, instance_ids=instance_ids,
+                                        filters=filters), key=lambda r: r.name)
+        if not records:
+            print "No running instances selected"
+            return
+
+        waves = chunks(records, wave_size(len(records), batch, pct))
+        start = time.time()
+        for number, wave in enumerate(waves, 1):
+            print "wave %s/%s: rebooting %s" % (number, len(waves),
+                                                ", ".join(r.name for r in wave))
+            self.client.reboot_instances(instance_ids=[r.id for r in wave])
+            time.sleep(grace)
+            deadline = time.time() + timeout
+            unhealthy = self._unhealthy(wave, mco)
+            while unhealthy and time.time() < deadline:
+                time.sleep(WAIT_INTERVAL)
+                unhealthy = self._unhealthy(wave, mco)
+            if unhealthy:
+                print "wave %s is not healthy after %ss: %s, stopping" % (
+                    number, int(timeout), ", ".join(sorted(unhealthy)))
+                return
+            print "wave %s/%s healthy" % (number, len(waves))
+        print "rebooted %s instances in %s waves in %ss" % (
+            len(records), len(waves), int(time.time() - start))
 
     def do_status(self, instance):
         """
@@ -50,6 +762,8 @@ class Provider(api.CmdApi):
 
             ec2> status <instance_id>
         """
+        import pprint
+
         reservations = self.client.get_all_instances(instance_ids=[instance])
         for r in reservations:
             for i in r.instances:
@@ -110,11 +824,19 @@ class Provider(api.CmdApi):
 
             ec2> deploy puppetmaster base role=puppetmaster
 
+        Instead of an ami id, an image can be given by name from the local
+        image index (see ``list images``), the newest matching one is used::
+
+            ec2> deploy web1 name:our-base-* ssh_key default role=web
+            ec2> deploy web1 name:our-base-*@latest ssh_key default role=web
+
         """
         if not userdata:
             print "Specify the machine userdata, (at least it's role)"
             return
 
+        from avira.deployplugin.ec2.tracing import span
+
         #vms = self.client.listVirtualMachines({
         #    'domainid': cfg.DOMAINID
         #})
@@ -123,26 +845,152 @@ class Provider(api.CmdApi):
         #existing_displaynames = \
         #    [x['displayname'] for x in vms if x['state'] not in KILLED]
 
-        cloudinit_url = cfg.CLOUDINIT_BASE if base else cfg.CLOUDINIT_PUPPET
-        ud = UserData(cloudinit_url, cfg.PUPPETMASTER, **userdata).formatted_data()
-        response = self.client.run_instances(ami,
-                                             key_name=key_name,
-                                             instance_type=cfg.INSTANCE_TYPE,
-                                             subnet_id=subnet_id,
-                                             security_groups=security_groups.split(","),
-                                             user_data=ud)
+        with span('deploy', name=displayname,
+                  role=userdata.get('role')) as root:
+            try:
+                with span('resolve_ami', ami=ami):
+                    ami = self._resolve_ami(ami)
+            except KeyError, e:
+                root.set('status', 'unknown image')
+                print e.args[0]
+                return
+            root.set('ami', ami)
+            instance = self._launch(displayname, ami, key_name,
+                                    security_groups, subnet_id, base, userdata)
+            root.set('instance_id', instance.id)
+        print "%s started, machine id %s" % (displayname, instance.id)
 
-        # Set instance name
-        instance = response.instances[0]
-        self.client.create_tags([instance.id], {"Name": displayname})
+    def _launch(self, displayname, ami, key_name, security_groups,
+                subnet_id, base, userdata, register_certificate=True):
+        from avira.deploy.certificate import add_pending_certificate
+        from avira.deploy.userdata import UserData
+        from avira.deployplugin.ec2.tracing import span
+
+        with span('userdata', base=bool(base)):
+            cloudinit_url = cfg.CLOUDINIT_BASE if base else cfg.CLOUDINIT_PUPPET
+            ud = UserData(cloudinit_url, cfg.PUPPETMASTER, **userdata).formatted_data()
+        with span('run_instances', ami=ami, subnet_id=subnet_id) as s:
+            response = self.client.run_instances(ami,
+                                                 key_name=key_name,
+                                                 instance_type=cfg.INSTANCE_TYPE,
+                                                 subnet_id=subnet_id,
+                                                 security_groups=security_groups.split(","),
+                                                 user_data=ud)
+
+            # Set instance name
+            instance = response.instances[0]
+            s.set('instance_id', instance.id)
+        with span('create_tags', instance_id=instance.id):
+            self.client.create_tags([instance.id], {"Name": displayname})
 
         # we add the machine id to the cert req file, so the puppet daemon
         # can sign the certificate
-        if not base:
+        if not base and register_certificate:
+            with span('add_pending_certificate', instance_id=instance.id):
+                add_pending_certificate(instance.id)
+
+        return instance
+
+    def _wait_until_running(self, instance, timeout=WAIT_TIMEOUT):
+        deadline = time.time() + timeout
+        while instance.update() != 'running':
+            if instance.state in ('shutting-down', 'terminated'):
+                raise RuntimeError("instance %s is %s" % (instance.id, instance.state))
+            if time.time() > deadline:
+                raise RuntimeError("instance %s not running after %ss" % (instance.id, timeout))
+            time.sleep(WAIT_INTERVAL)
+        return instance
+
+    def do_provision(self, prefix, count, ami, key_name, security_groups,
+                     subnet_id=None, base=False, launch_workers=5,
+                     running_workers=20, certificate_workers=5,
+                     agent_workers=20, kick_workers=5, **userdata):
+        """
+        Deploy many machines at once and bring them all the way up.
+
+        Every machine goes through launch, certificate registration, waiting
+        until it is running, waiting until its puppet agent answers mco and
+        a first puppet run on its own, so a slow machine does not hold back
+        the others. Each stage has its own concurrency limit.
+
+        Usage::
+
+            ec2> provision <prefix> <count> <ami|name:pattern> <key_name> <security-groups> <userdata>
+                    optional: subnet_id=<subnet> base=True
+                              launch_workers=5 running_workers=20
+                              certificate_workers=5 agent_workers=20
+                              kick_workers=5
+
+        The machines are named <prefix>1 .. <prefix><count>::
+
+            ec2> provision web 40 ami-c1aaabb5 ssh_key default role=web
+
+        A per-stage summary of throughput and latency is printed at the end.
+        """
+        if not userdata:
+            print "Specify the machine userdata, (at least it's role)"
+            return
+
+        import subprocess
+        from avira.deploy.certificate import add_pending_certificate
+        from avira.deployplugin.ec2.mco import identity_filter, \
+            processed_hosts
+        from avira.deployplugin.ec2.pipeline import Stage, Pipeline
+
+        try:
+            ami = self._resolve_ami(ami)
+        except KeyError, e:
+            print e.args[0]
+            return
+
+        names = ["%s%s" % (prefix, n) for n in range(1, int(count) + 1)]
+
+        def launch(name):
+            # certificates are registered in their own stage
+            return name, self._launch(name, ami, key_name, security_groups,
+                                      subnet_id, base, userdata,
+                                      register_certificate=False)
+
+        def running((name, instance)):
+            return name, self._wait_until_running(instance)
+
+        def certificate((name, instance)):
             add_pending_certificate(instance.id)
+            return name, instance
+
+        def agent((name, instance)):
+            # cloud-init installs and starts the agent after boot
+            self._wait_for_agent(name)
+            return name, instance
+
+        def kick((name, instance)):
+            output = subprocess.check_output(['mco', "puppetd", "runonce",
+                                              "-I", identity_filter([name])],
+                                             stderr=subprocess.STDOUT)
+            if not processed_hosts(output):
+                raise RuntimeError("no puppet agent answered the run on %s" % name)
+            return name, instance
+
+        # the certificate is registered while the instance is still
+        # pending, as deploy does, so the agent's first request is signed
+        stages = [Stage('launch', launch, launch_workers)]
+        if not base:
+            stages.append(Stage('certificate', certificate, certificate_workers))
+        stages.append(Stage('running', running, running_workers))
+        if not base:
+            stages.append(Stage('agent', agent, agent_workers))
+            stages.append(Stage('kick', kick, kick_workers))
 
-        print "%s started, machine id %s" % (displayname, instance.id)
+        def on_done(name, result, stage, error):
+            if error is None:
+                print "%s provisioned, machine id %s" % (name, result[1].id)
+            else:
+                print "%s failed in stage %s: %s" % (name, stage, error)
 
+        pipeline = Pipeline(stages, on_done=on_done)
+        pipeline.run(names)
+        for line in pipeline.report():
+            print line
 
     def do_destroy(self, instance_id):
         """
@@ -152,41 +1000,64 @@ class Provider(api.CmdApi):
 
             ec2> destroy <instance_id>
         """
+        import boto.exception
+        from avira.deploy.clean import run_machine_cleanup, node_clean, \
+            clean_foreman
+        from avira.deploy.utils import is_puppetmaster
+        from avira.deployplugin.ec2.tracing import span
 
         def get_machine_by_id(client, instance_id):
-            reservations = client.get_all_instances()
+            # only describe the machine we are after instead of the whole
+            # account
+            try:
+                reservations = client.get_all_instances(instance_ids=[instance_id])
+            except boto.exception.EC2ResponseError, e:
+                # throttling or auth errors are not a missing machine
+                if not (e.error_code or '').startswith('InvalidInstanceID'):
+                    raise
+                return None
             for r in reservations:
                 for i in r.instances:
                     if i.id == instance_id:
                         return i
             return None
 
-        #
-        # List instances
-        # determine which machine we're destroying
-        #
-        machine = get_machine_by_id(self.client, instance_id)
+        with span('destroy', instance_id=instance_id) as root:
+            #
+            # List instances
+            # determine which machine we're destroying
+            #
+            with span('describe', instance_id=instance_id):
+                machine = get_machine_by_id(self.client, instance_id)
 
-        if machine is None:
-            print "No machine found with the id %s" % machine.id
-        else:
+            if machine is None:
+                root.set('status', 'not found')
+                print "No machine found with the id %s" % instance_id
+                return
+            root.set('name', machine.tags.get('Name'))
+            root.set('role', machine.tags.get('Role'))
             if is_puppetmaster(machine.id):
+                root.set('status', 'refused')
                 print "You are not allowed to destroy the puppetmaster"
                 return
             print "running cleanup job on %s." % (machine.tags['Name'] if 'Name' in machine.tags else 'N/A')
-            run_machine_cleanup(machine)
+            with span('run_machine_cleanup', instance_id=instance_id):
+                run_machine_cleanup(machine)
 
-            self.client.terminate_instances(instance_ids=[instance_id])
+            with span('terminate_instances', instance_id=instance_id):
+                self.client.terminate_instances(instance_ids=[instance_id])
 
             # first we are also going to remove the portforwards
             # remove_machine_port_forwards(machine, self.client)
 
             # now we cleanup the puppet database and certificates
             print "running puppet node clean"
-            node_clean(machine)
+            with span('node_clean', instance_id=instance_id):
+                node_clean(machine)
 
             # now clean all offline nodes from foreman
-            clean_foreman()
+            with span('clean_foreman'):
+                clean_foreman()
 
     def do_start(self, instance_id):
         """
@@ -221,7 +1092,7 @@ class Provider(api.CmdApi):
         print "rebooting instance id {0}".format(instance_id)
         self.client.reboot_instances(instance_ids=[instance_id])
 
-    def do_list(self, resource_type, *args):
+    def do_list(self, resource_type, *args, **kwargs):
         """
         List information about current EC2 configuration.
 
@@ -231,7 +1102,25 @@ class Provider(api.CmdApi):
 
             ec2> list vpc subnets|customer-gateways|internet-gateways|vpn-gateways|vpn-connections
 
+        Instances can be listed while the response is still coming in,
+        which is a lot faster on large accounts::
+
+            ec2> list instances fast=True
+
+        Images are described from EC2, by default the ones of our own
+        account. Filter by owner, name or tag, or list the local image index
+        deploy uses to find images by name (refresh=True fetches it again)::
+
+            ec2> list images [owner=self|amazon|<account>] [name=our-base-*] [tag:Key=Value]
+            ec2> list images index=True [name=our-base-*] [refresh=True]
+
+        When the background refresher runs (see ``refresher``), instances,
+        volumes, eip and vpc subnets are listed from its snapshot.
+
         """
+        import pprint
+        from avira.deployplugin.ec2.describe import iter_instances
+        from avira.deployplugin.ec2.records import instance_records
 
         if resource_type == "regions":
             for r in self.client.get_all_regions():
@@ -242,25 +1131,41 @@ class Provider(api.CmdApi):
                 print "{0:<15}\t{1:<15}\t{2}".format(i.name, i.region.name, i.fingerprint)
         elif resource_type == "eip":
             print "%17s\t%15s\t%s" % ("address", "region", "instance")
-            for r in self.client.get_all_addresses():
+            for r in self._cached('addresses', self.client.get_all_addresses):
                 print "%17s\t%15s\t%s" % (r.public_ip, r.region.name, r.instance_id)
+        elif resource_type == "images":
+            print "{0:<15}\t{1:<40}\t{2:<12}\t{3:<25}\t{4}".format("Id", "Name", "State", "Created", "Owner")
+            if kwargs.pop('index', False):
+                index = self.get_image_index(refresh=kwargs.get('refresh', False))
+                images = index.match(kwargs.get('name', '*'))
+            else:
+                owners = kwargs.pop('owner', ','.join(self._image_owners()))
+                images = [(i.name, i.id, i.creation_date, i.owner_id, i.state)
+                          for i in self.client.get_all_images(
+                              owners=owners.split(','), filters=kwargs or None)]
+            for name, image_id, created, owner, state in images:
+                print "{0:<15}\t{1:<40}\t{2:<12}\t{3:<25}\t{4}".format(
+                    image_id, name, state, created, owner)
         elif resource_type == "placement-groups":
             print "{0:<15}\t{1:<15}\t{2:<15}\t{3:<15}".format("Name", "Region", "Strategy", "State")
             for r in self.client.get_all_placement_groups():
                 print "{0:<15}\t{1:<15}\t{2:<15}\t{3:<15}".format(r.name, r.region.name, r.strategy, r.state)
         elif resource_type == "instances":
-            reservations = self.client.get_all_instances()
             print "{0:<15}\t{1:<20}\t{2:<15}\t{3:<15}\t{4}".format("Id", "Name", "VPC Id", "State", "Dns")
-            for r in reservations:
-                for i in r.instances:
-                    print "{0:<15}\t{1:<20}\t{2:<15}\t{3:<15}\t{4}".format(i.id,
-                            i.tags['Name'] if 'Name' in i.tags else 'N/A',
-                            i.vpc_id,
-                            i._state,
-                            i.dns_name)
+            if kwargs.get('fast'):
+                instances = iter_instances(self.client)
+            else:
+                instances = self._cached('instances', lambda:
+                    instance_records(self.client.get_all_instances()))
+            for i in instances:
+                print "{0:<15}\t{1:<20}\t{2:<15}\t{3:<15}\t{4}".format(i.id,
+                        i.name,
+                        i.vpc_id,
+                        i.state,
+                        i.dns_name)
         elif resource_type == "volumes":
             print "{0:<15}\t{1:<15}\t{2:<20}\t{3:<10}\t{4:<15}\t{5:<15}\t{6}".format("Id", "Region", "Snapshot", "Size", "Status", "Zone", "Created")
-            for r in self.client.get_all_volumes():
+            for r in self._cached('volumes', self.client.get_all_volumes):
                 print "{0:<15}\t{1:<15}\t{2:<20}\t{3:<10}\t{4:<15}\t{5:<15}\t{6}".format(r.id,
                                                                                          r.region.name,
                                                                                          r.snapshot_id,
@@ -295,7 +1200,7 @@ class Provider(api.CmdApi):
                     print "{0:<15}\t{1:<15}\t{2:<15}\t{3}".format(v.id, v.region.name, v.state, v.cidr_block)
             elif args[0] == "subnets":
                 print "{0:<15}\t{1:<15}\t{2:<6}\t{3:<15}\t{4:<15}\t{5:<15}\t{6}".format("Id", "Zone", "AvailIP", "CIDR", "Region", "State", "VPC-ID")
-                for s in self.vpc.get_all_subnets():
+                for s in self._cached('subnets', self.vpc.get_all_subnets):
                     print "{0:<15}\t{1:<15}\t{2:<6}\t{3:<15}\t{4:<15}\t{5:<15}\t{6}".format(s.id,
                                                                                             s.availability_zone,
                                                                                             s.available_ip_address_count,
@@ -322,17 +1227,164 @@ class Provider(api.CmdApi):
             else:
                 print "not implemented"
 
-    def do_vpc(self, request_type, *args):
+    def do_watch(self, resource_type, *args, **kwargs):
+        """
+        Poll a set of instances and only print what changed: new
+        instances, state changes and instances which are gone.
+
+        Usage::
+
+            ec2> watch instances [selector] [interval=5] [count=<polls>]
+
+        The selector is a list of instance ids and/or filters like
+        name=web* tag:Role=lvs state=running vpc-id=<vpc>. Only the
+        selected instances are described on every poll. Stop with ctrl-c.
+        """
+        import boto.exception
+        from avira.deployplugin.ec2.describe import iter_instances
+        from avira.deployplugin.ec2.selector import instance_selector
+        from avira.deployplugin.ec2.watch import transitions, \
+            missing_instances, NEW, GONE
+
+        if resource_type != "instances":
+            print "Not implemented"
+            return
+        interval = float(kwargs.pop('interval', 5))
+        count = kwargs.pop('count', None)
+        try:
+            instance_ids, filters = instance_selector(args, kwargs)
+        except ValueError, e:
+            print e
+            return
+
+        previous = {}
+        polls = 0
+        try:
+            while True:
+                now = time.strftime('%H:%M:%S')
+                try:
+                    if instance_ids == []:
+                        # every selected instance is gone
+                        current = {}
+                    else:
+                        current = dict((r.id, r) for r in iter_instances(
+                            self.client, instance_ids=instance_ids,
+                            filters=filters))
+                except boto.exception.EC2ResponseError, e:
+                    # terminated instances age out and fail the whole
+                    # describe, stop asking for them so they show as gone
+                    missing = missing_instances(e, instance_ids)
+                    if missing:
+                        instance_ids = [i for i in instance_ids if i not in missing]
+                        continue
+                    print "%s	error: %s" % (now, e.error_message or e)
+                    current = previous
+                for kind, instance_id, old, new, record in transitions(previous, current):
+                    if kind == NEW:
+                        change = "new (%s)" % new
+                    elif kind == GONE:
+                        change = "gone"
+                    else:
+                        change = "%s -> %s" % (old, new)
+                    print "{0}\t{1:<15}\t{2:<20}\t{3}".format(now, instance_id,
+                                                              record.name, change)
+                previous = current
+                polls += 1
+                if count is not None and polls >= int(count):
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+    def do_summary(self, *keys, **filters):
+        """
+        Count instances and sum their volume sizes, grouped by any instance
+        attribute or tag. The cached inventory is used, add refresh=True to
+        fetch it again.
+
+        Usage::
+
+            ec2> summary <attribute|tag:key> [...] [attribute=value ...]
+                    optional: refresh=True format=jsonl
+
+        Attributes are id, state, instance_type, vpc_id, subnet_id,
+        placement, image_id, key_name and dns_name, e.g.::
+
+            ec2> summary vpc_id tag:Role instance_type=m1.large state=running
+        """
+        import json
+
+        refresh = filters.pop('refresh', False)
+        output = filters.pop('format', 'table')
+        if not keys:
+            keys = ('state',)
+        inventory = self.get_inventory(refresh=refresh)
+        try:
+            rows = inventory.summary(keys, **filters)
+        except KeyError, e:
+            print e.args[0]
+            return
+
+        if output == 'jsonl':
+            for group, count, size in rows:
+                row = dict(zip(keys, group))
+                row.update(count=count, volume_size=size)
+                print json.dumps(row, sort_keys=True)
+            return
+
+        line = "\t".join(["{%s:<20}" % n for n in range(len(keys))] +
+                         ["{%s:<8}" % len(keys), "{%s}" % (len(keys) + 1)])
+        print line.format(*(keys + ("Count", "Volume GB")))
+        for group, count, size in rows:
+            print line.format(*(group + (count, size)))
+
+    def do_vpc(self, request_type, *args, **kwargs):
         """
         VPC related operations
 
         Usage::
 
            ec2> vpc create <vpc_id> <cidr_block>
+
+        or let the next free, aligned block of a size be picked from the
+        vpc's cidr block, optionally several at once::
+
+           ec2> vpc create <vpc_id> size=/24 [az=<availability zone>] [count=<n>]
         """
         if request_type == "create":
-            print "creating subnet {0} in vpc {1}".format(args[1], args[0])
-            print self.vpc.create_subnet(args[0], args[1])
+            if len(args) > 1:
+                print "creating subnet {0} in vpc {1}".format(args[1], args[0])
+                print self.vpc.create_subnet(args[0], args[1])
+            elif args and 'size' in kwargs:
+                self._create_subnets(args[0], kwargs['size'], kwargs.get('az'),
+                                     int(kwargs.get('count', 1)))
+            else:
+                print "Specify a cidr block or size=/<prefix>"
+
+    def _create_subnets(self, vpc_id, size, zone=None, count=1):
+        from avira.deployplugin.ec2.cidr import CidrAllocator, subnet_prefix
+
+        try:
+            size = subnet_prefix(size)
+        except ValueError, e:
+            print e
+            return
+        vpcs = self.vpc.get_all_vpcs(vpc_ids=[vpc_id])
+        if not vpcs:
+            print "vpc %s not found" % vpc_id
+            return
+        subnets = self.vpc.get_all_subnets(filters={'vpc-id': vpc_id})
+        allocator = CidrAllocator(vpcs[0].cidr_block,
+                                  [s.cidr_block for s in subnets])
+        for _ in range(count):
+            try:
+                cidr_block = allocator.allocate(size)
+            except ValueError, e:
+                print "%s in vpc %s" % (e, vpc_id)
+                return
+            print "creating subnet {0} in vpc {1}".format(cidr_block, vpc_id)
+            print self.vpc.create_subnet(vpc_id, cidr_block,
+                                         availability_zone=zone)
 
 
     def do_request(self, request_type):
@@ -381,6 +1433,9 @@ class Provider(api.CmdApi):
             cloudstack> kick role=<role>
 
         """
+        import subprocess
+        from avira.deploy.utils import find_machine
+
         KICK_CMD = ['mco', "puppetd", "runonce", "-F"]
         if role is not None:
             KICK_CMD.append("role=%s" % role)
@@ -399,6 +1454,120 @@ class Provider(api.CmdApi):
         except subprocess.CalledProcessError as e:
             print e.output
 
+    def do_profile(self, command, *args, **kwargs):
+        """
+        Run a command under the profiler and show where the time went.
+
+        Usage::
+
+            ec2> profile <command> [arguments]
+                    optional: profile_limit=20 profile_out=<file.pstats>
+
+        e.g.::
+
+            ec2> profile list instances profile_out=/tmp/list.pstats
+
+        To profile a whole session, start the tool with AVIRA_EC2_PROFILE=1
+        (or AVIRA_EC2_PROFILE=/path/to/file.pstats).
+        """
+        from avira.deployplugin.ec2.profiling import profile_call, print_report
+
+        limit = kwargs.pop('profile_limit', 20)
+        path = kwargs.pop('profile_out', None)
+        handler = getattr(self, 'do_' + command.replace('-', '_'), None)
+        if handler is None or command == 'profile':
+            print "unknown command %s" % command
+            return
+        _, profiler = profile_call(handler, *args, **kwargs)
+        print_report(profiler, limit=limit, path=path)
+
+    def do_trace(self, action='status', path=None):
+        """
+        Write the phases of deploy and destroy (describe, cleanup, terminate,
+        puppet node clean ...) with their timings to a trace file. Open the
+        file in chrome://tracing or https://ui.perfetto.dev.
+
+        Usage::
+
+            ec2> trace start <file.json>
+            ec2> trace stop
+            ec2> trace status
+
+        To trace a whole session, start the tool with
+        AVIRA_EC2_TRACE=/path/to/trace.json
+        """
+        from avira.deployplugin.ec2 import tracing
+
+        if action == 'start':
+            if not path:
+                print "Specify the trace file"
+                return
+            tracing.enable(path)
+            print "tracing to %s" % path
+        elif action == 'stop':
+            tracing.disable()
+            print "tracing stopped"
+        elif action == 'status':
+            if tracing.enabled():
+                print "tracing to %s" % tracing.path()
+            else:
+                print "tracing is off"
+        else:
+            print "Not implemented"
+
+    def do_jobs(self, _=None):
+        """
+        List the background jobs. Run a command in the background with a
+        trailing & or the bg prefix::
+
+            ec2> destroy i-1234abcd &
+            ec2> bg mco puppetd status
+
+        Usage::
+
+            ec2> jobs
+        """
+        if not self._jobs or not self._jobs.jobs:
+            print "no jobs"
+            return
+        for number in sorted(self._jobs.jobs):
+            print self._jobs.jobs[number]
+
+    def _show_job(self, job):
+        self._jobs.wait(job)
+        print job
+        output = job.output.getvalue()
+        if output:
+            print output.rstrip('\n')
+
+    def do_fg(self, number=None):
+        """
+        Wait for a background job and show its output, the latest job by
+        default.
+
+        Usage::
+
+            ec2> fg [<job number>]
+        """
+        job = self._jobs.get(number) if self._jobs else None
+        if job is None:
+            print "no such job"
+            return
+        self._show_job(job)
+
+    def do_wait(self, _=None):
+        """
+        Wait for all background jobs and show the output of each.
+
+        Usage::
+
+            ec2> wait
+        """
+        if not self._jobs:
+            return
+        for number in sorted(self._jobs.jobs):
+            self._show_job(self._jobs.jobs[number])
+
     def do_quit(self, _=None):
         """
         Quit the deployment tool.
@@ -418,5 +1587,7 @@ class Provider(api.CmdApi):
             cloudstack> mco find all
             cloudstack> mco puppetd status -F role=puppetmaster
         """
+        from avira.deploy.utils import check_call_with_timeout
+
         command = ['mco'] + list(args) + ['%s=%s' % (key, value) for (key, value) in kwargs.iteritems()]
         check_call_with_timeout(command, 30)
@@ -0,0 +1,93 @@
+"""
+Compact instance records.
+
+boto instances carry the connection, the parsed response and dozens of
+attributes we never look at. The records below only keep the fields the
+provider uses, in ``__slots__``, and share one copy of values which repeat
+across a fleet (state, instance type, VPC, tag keys ...). Values which are
+mostly unique, like ids, addresses and tag values, are not shared, so the
+table of shared values stays small in a long session.
+"""
+
+__all__ = ('InstanceRecord', 'instance_records')
+
+_strings = {}
+
+
+def intern_value(value):
+    """
+    intern() for str and unicode values, None is passed through. Only for
+    values with few distinct ones, the table is never cleared.
+    """
+    if value is None:
+        return None
+    return _strings.setdefault(value, value)
+
+
+class InstanceRecord(object):
+    """ The fields of an instance the provider works with """
+
+    __slots__ = ('id', 'state', 'instance_type', 'vpc_id', 'subnet_id',
+                 'placement', 'image_id', 'key_name', 'dns_name',
+                 'private_ip_address', '_tags')
+
+    def __init__(self, id, state=None, instance_type=None, vpc_id=None,
+                 subnet_id=None, placement=None, image_id=None,
+                 key_name=None, dns_name=None, private_ip_address=None,
+                 tags=None):
+        self.id = id
+        self.state = intern_value(state)
+        self.instance_type = intern_value(instance_type)
+        self.vpc_id = intern_value(vpc_id)
+        self.subnet_id = intern_value(subnet_id)
+        self.placement = intern_value(placement)
+        self.image_id = image_id
+        self.key_name = key_name
+        self.dns_name = dns_name
+        self.private_ip_address = private_ip_address
+        self._tags = tuple((intern_value(k), v)
+                           for k, v in (tags or {}).items())
+
+    @classmethod
+    def from_boto(cls, instance):
+        return cls(instance.id,
+                   state=instance.state,
+                   instance_type=instance.instance_type,
+                   vpc_id=instance.vpc_id,
+                   subnet_id=instance.subnet_id,
+                   placement=instance.placement,
+                   image_id=instance.image_id,
+                   key_name=instance.key_name,
+                   dns_name=instance.dns_name,
+                   private_ip_address=instance.private_ip_address,
+                   tags=instance.tags)
+
+    @property
+    def tags(self):
+        return dict(self._tags)
+
+    def update_tags(self, tags=None, remove=()):
+        """ set ``tags`` and delete the ``remove`` keys in place """
+        current = dict(self._tags)
+        for key in remove:
+            current.pop(key, None)
+        current.update(tags or {})
+        self._tags = tuple((intern_value(k), v)
+                           for k, v in current.items())
+
+    @property
+    def name(self):
+        for key, value in self._tags:
+            if key == 'Name':
+                return value
+        return 'N/A'
+
+    def __repr__(self):
+        return "InstanceRecord:%s" % self.id
+
+
+def instance_records(reservations):
+    """ Turn describe reservations into records, one instance at a time """
+    for r in reservations:
+        for i in r.instances:
+            yield InstanceRecord.from_boto(i)
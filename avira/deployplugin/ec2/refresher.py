@@ -0,0 +1,188 @@
+"""
+Background inventory refresher for the interactive prompt.
+
+A daemon thread keeps a snapshot of instances, volumes, subnets and elastic
+ips fresh, so commands can answer from it instead of waiting for describe
+calls. EC2 has no conditional requests, so every resource type has its own
+refresh interval (instances change a lot more often than subnets) and the
+snapshot is only replaced when a response actually differs. The thread
+stops polling while the prompt has been idle for a while.
+"""
+import copy
+import threading
+import time
+
+from avira.deployplugin.ec2.describe import iter_instances
+
+__all__ = ('Snapshot', 'InventoryRefresher')
+
+# seconds between refreshes per resource type
+INTERVALS = {
+    'instances': 30,
+    'volumes': 120,
+    'addresses': 120,
+    'subnets': 600,
+}
+
+# stop polling after this many seconds without a command
+IDLE_TIMEOUT = 900
+
+
+def _fingerprint(resource, items):
+    # the fields which show up in listings, used to detect changes
+    if resource == 'instances':
+        return frozenset((i.id, i.state, i.dns_name, i._tags) for i in items)
+    if resource == 'volumes':
+        return frozenset((v.id, v.status, v.size,
+                          getattr(v.attach_data, 'instance_id', None))
+                         for v in items)
+    if resource == 'addresses':
+        return frozenset((a.public_ip, a.instance_id) for a in items)
+    return frozenset((s.id, s.state, s.available_ip_address_count)
+                     for s in items)
+
+
+class Snapshot(object):
+    """
+    An immutable set of resources. The refresher replaces the whole
+    snapshot, so readers never see a half updated one. Changes made by the
+    foreground go through ``invalidate`` and ``update_tags``, which build a
+    new snapshot as well.
+    """
+
+    def __init__(self, resources, taken, version):
+        self.resources = resources
+        self.taken = taken
+        self.version = version
+
+    def get(self, resource):
+        return self.resources.get(resource)
+
+    def age(self, resource):
+        return time.time() - self.taken.get(resource, 0)
+
+
+class InventoryRefresher(threading.Thread):
+    """
+    Refresh the snapshot in the background. ``connect`` returns a fresh
+    ``(ec2, vpc)`` connection pair, the thread does not share connections
+    with the foreground.
+    """
+
+    def __init__(self, connect, intervals=None, idle_timeout=IDLE_TIMEOUT):
+        threading.Thread.__init__(self, name='inventory-refresher')
+        self.daemon = True
+        self.connect = connect
+        self.intervals = dict(INTERVALS, **(intervals or {}))
+        self.idle_timeout = idle_timeout
+        self.snapshot = Snapshot({}, {}, 0)
+        self.errors = 0
+        self.last_error = None
+        self._fingerprints = {}
+        self._invalidated = {}
+        self._lock = threading.Lock()
+        self._halt = threading.Event()
+        self._active = threading.Event()
+        self.touch()
+
+    def touch(self):
+        """ record foreground activity, wakes up an idle refresher """
+        self.last_activity = time.time()
+        self._active.set()
+
+    def stop(self):
+        self._halt.set()
+        self._active.set()
+
+    @property
+    def idle(self):
+        return time.time() - self.last_activity > self.idle_timeout
+
+    def _fetch(self, client, vpc, resource):
+        if resource == 'instances':
+            return list(iter_instances(client))
+        if resource == 'volumes':
+            return client.get_all_volumes()
+        if resource == 'addresses':
+            return client.get_all_addresses()
+        return vpc.get_all_subnets()
+
+    def _update(self, resource, items, started):
+        fingerprint = _fingerprint(resource, items)
+        with self._lock:
+            if started < self._invalidated.get(resource, 0):
+                return
+            current = self.snapshot
+            taken = dict(current.taken)
+            taken[resource] = time.time()
+            if self._fingerprints.get(resource) == fingerprint:
+                # unchanged, only the time of the check moves on
+                self.snapshot = Snapshot(current.resources, taken,
+                                         current.version)
+                return
+            self._fingerprints[resource] = fingerprint
+            resources = dict(current.resources)
+            resources[resource] = items
+            self.snapshot = Snapshot(resources, taken, current.version + 1)
+
+    def invalidate(self, *resources):
+        """
+        Drop resources the foreground changed from the snapshot. Readers
+        fetch them themselves until the next cycle refreshes them, results
+        of fetches which started before are thrown away.
+        """
+        with self._lock:
+            current = self.snapshot
+            kept = dict(current.resources)
+            taken = dict(current.taken)
+            for resource in resources:
+                self._invalidated[resource] = time.time()
+                kept.pop(resource, None)
+                taken.pop(resource, None)
+                self._fingerprints.pop(resource, None)
+            self.snapshot = Snapshot(kept, taken, current.version + 1)
+
+    def update_tags(self, resource_ids, tags=None, remove=()):
+        """ a new snapshot with the tag change made by the foreground """
+        selected = set(resource_ids)
+        with self._lock:
+            current = self.snapshot
+            instances = current.get('instances')
+            if instances is None:
+                return
+            updated = []
+            for record in instances:
+                if record.id in selected:
+                    record = copy.copy(record)
+                    record.update_tags(tags, remove)
+                updated.append(record)
+            self._fingerprints['instances'] = _fingerprint('instances', updated)
+            resources = dict(current.resources)
+            resources['instances'] = updated
+            self.snapshot = Snapshot(resources, current.taken,
+                                     current.version + 1)
+
+    def refresh(self, client, vpc, force=False):
+        """ refresh every resource type which is due """
+        for resource, interval in self.intervals.items():
+            if not force and self.snapshot.age(resource) < interval:
+                continue
+            started = time.time()
+            try:
+                self._update(resource, self._fetch(client, vpc, resource),
+                             started)
+            except Exception, e:
+                self.errors += 1
+                self.last_error = e
+
+    def run(self):
+        client, vpc = self.connect()
+        while not self._halt.is_set():
+            if self.idle:
+                # sleep until the next command comes in
+                self._active.clear()
+                if self.idle:
+                    self._active.wait()
+                continue
+            self.refresh(client, vpc)
+            self._halt.wait(min(self.intervals.values()))
@@ -0,0 +1,107 @@
+"""
+Security group rules as sets, for ``sg sync``.
+
+A rule is a ``(protocol, from_port, to_port, source)`` tuple, where source
+is a CIDR or a security group id. The rules of a group are compared as
+sets, and only the difference is sent to EC2. All rules of one direction
+and action go into a single request per group.
+
+The desired rules are read from a json file mapping group ids or names to
+their ingress and egress rules::
+
+    {
+        "sg-1a2b3c4d": {
+            "ingress": [["tcp", 22, 22, "10.0.0.0/8"],
+                        ["tcp", 80, 80, "sg-5e6f7a8b"]],
+            "egress": [["-1", null, null, "0.0.0.0/0"]]
+        }
+    }
+
+A direction which is left out is not touched.
+"""
+import json
+
+__all__ = ('rule', 'current_rules', 'load_desired', 'diff',
+           'permission_params')
+
+DIRECTIONS = ('ingress', 'egress')
+
+
+def _port(value):
+    # -1 stays, for icmp it is the wildcard type or code
+    if value is None or str(value) == '':
+        return None
+    return str(int(value))
+
+
+def rule(protocol, from_port, to_port, source):
+    """ a normalized rule tuple """
+    protocol = str(protocol).lower()
+    if protocol in ('-1', 'all'):
+        return ('-1', None, None, source)
+    return (protocol, _port(from_port), _port(to_port), source)
+
+
+def current_rules(permissions):
+    """ the rule set of boto ``rules`` or ``rules_egress`` """
+    rules = set()
+    for permission in permissions:
+        for grant in permission.grants:
+            source = grant.cidr_ip or grant.group_id
+            rules.add(rule(permission.ip_protocol, permission.from_port,
+                           permission.to_port, source))
+    return rules
+
+
+def load_desired(path):
+    """
+    Read the desired rules, returns ``{group: {direction: set(rules)}}``.
+    Raises ValueError for a malformed file.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    desired = {}
+    for group, directions in data.items():
+        desired[group] = {}
+        for direction, rules in directions.items():
+            if direction not in DIRECTIONS:
+                raise ValueError("%s: unknown direction %s" % (group, direction))
+            try:
+                desired[group][direction] = set(rule(*r) for r in rules)
+            except TypeError:
+                raise ValueError("%s: rules are [protocol, from_port, to_port, source]" % group)
+    return desired
+
+
+def diff(current, desired):
+    """ ``(to_authorize, to_revoke)`` to get from current to desired """
+    return desired - current, current - desired
+
+
+def permission_params(rules):
+    """
+    Query parameters for all rules in one Authorize/Revoke request. Rules
+    with the same protocol and ports share a permission.
+    """
+    permissions = {}
+    for protocol, from_port, to_port, source in rules:
+        permissions.setdefault((protocol, from_port, to_port), []).append(source)
+
+    params = {}
+    for n, ((protocol, from_port, to_port), sources) in \
+            enumerate(sorted(permissions.items()), 1):
+        prefix = 'IpPermissions.%d.' % n
+        params[prefix + 'IpProtocol'] = protocol
+        if from_port is not None:
+            params[prefix + 'FromPort'] = from_port
+        if to_port is not None:
+            params[prefix + 'ToPort'] = to_port
+        ranges = groups = 0
+        for source in sorted(sources):
+            if source.startswith('sg-'):
+                groups += 1
+                params[prefix + 'Groups.%d.GroupId' % groups] = source
+            else:
+                ranges += 1
+                params[prefix + 'IpRanges.%d.CidrIp' % ranges] = source
+    return params
@@ -0,0 +1,73 @@
+"""
+Instance selectors shared by the commands working on groups of machines.
+
+A selector is a list of instance ids and/or ``key=value`` criteria, which
+are turned into DescribeInstances filters, so EC2 only returns the
+matching instances::
+
+    i-1234abcd i-5678ef01
+    name=web*                  the Name tag, wildcards are allowed
+    tag:Role=lvs               any tag
+    state=running              instance state
+    vpc-id=vpc-1a2b3c4d        one of the EC2 instance filters below
+"""
+
+__all__ = ('instance_selector', 'split_criteria', 'is_resource_id')
+
+ALIASES = {
+    'name': 'tag:Name',
+    'state': 'instance-state-name',
+    'type': 'instance-type',
+}
+
+# DescribeInstances filters accepted besides the aliases and tag:<key>
+INSTANCE_FILTERS = frozenset([
+    'architecture', 'availability-zone', 'dns-name', 'group-id',
+    'group-name', 'iam-instance-profile.arn', 'image-id', 'instance-id',
+    'instance-lifecycle', 'instance-state-code', 'instance-state-name',
+    'instance-type', 'instance.group-id', 'instance.group-name',
+    'ip-address', 'kernel-id', 'key-name', 'launch-time',
+    'monitoring-state', 'owner-id', 'placement-group-name', 'platform',
+    'private-dns-name', 'private-ip-address', 'root-device-type',
+    'source-dest-check', 'subnet-id', 'tag-key', 'tag-value', 'tenancy',
+    'virtualization-type', 'vpc-id',
+])
+
+# prefixes of the resource ids bulk commands accept
+RESOURCE_PREFIXES = ('i-', 'vol-', 'snap-', 'eipalloc-', 'ami-', 'sg-')
+
+
+def is_resource_id(arg):
+    return arg.startswith(RESOURCE_PREFIXES)
+
+
+def split_criteria(kwargs):
+    """
+    Split keyword arguments into selector criteria and the rest. Criteria
+    are the aliases, tag:<key> and INSTANCE_FILTERS, e.g. ``tag:Role=web
+    Role=lvs cost-center=ops`` selects by the first and sets the others.
+    """
+    criteria, rest = {}, {}
+    for key, value in kwargs.items():
+        if key in ALIASES or key.startswith('tag:') or key in INSTANCE_FILTERS:
+            criteria[key] = value
+        else:
+            rest[key] = value
+    return criteria, rest
+
+
+def instance_selector(args, criteria):
+    """
+    Turn selector arguments into ``(instance_ids, filters)`` for
+    ``get_all_instances``. Raises ValueError for arguments which are
+    neither instance ids nor criteria.
+    """
+    instance_ids = []
+    for arg in args:
+        if not arg.startswith('i-'):
+            raise ValueError("%s is not an instance id" % arg)
+        instance_ids.append(arg)
+    filters = {}
+    for key, value in criteria.items():
+        filters[ALIASES.get(key, key)] = value
+    return instance_ids or None, filters or None
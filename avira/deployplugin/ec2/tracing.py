@@ -0,0 +1,143 @@
+"""
+Span based tracing of the phases of a command.
+
+Spans are written as complete ("X") events of the Chrome trace event
+format, which chrome://tracing and Perfetto load. The file is a json array
+which is appended to as spans finish; the format allows leaving out the
+closing bracket, so a trace survives a crash. Nested spans on a thread are
+shown as children, the span and parent ids are in the event args as well.
+
+While tracing is off, ``span`` returns one shared no-op object, so the
+instrumented code only pays for a function call.
+"""
+import itertools
+import json
+import os
+import threading
+import time
+
+__all__ = ('span', 'enable', 'disable', 'enabled', 'path')
+
+ENV_VARIABLE = 'AVIRA_EC2_TRACE'
+
+
+class _NoopSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+NOOP = _NoopSpan()
+
+
+class Tracer(object):
+    """ Writes finished spans to a trace file """
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self._file = open(path, 'w')
+        self._file.write('[\n')
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.local = threading.local()
+
+    def next_id(self):
+        with self._lock:
+            return next(self._ids)
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def write(self, event):
+        line = json.dumps(event, default=str) + ',\n'
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Span(object):
+    """ A timed phase with attributes, use it as a context manager """
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.id = tracer.next_id()
+        self.parent = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        self.parent = stack[-1].id if stack else None
+        stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.time()
+        self.tracer.stack().pop()
+        # a status set by the code wins over 'ok', not over an exception
+        args = dict(status='ok', span_id=self.id, parent_id=self.parent)
+        args.update(self.attributes)
+        if exc_type is not None:
+            args['status'] = 'error'
+            args['error'] = "%s: %s" % (exc_type.__name__, exc_value)
+        self.tracer.write({'name': self.name, 'ph': 'X', 'cat': 'ec2',
+                           'ts': int(self.start * 1e6),
+                           'dur': int((end - self.start) * 1e6),
+                           'pid': self.tracer.pid,
+                           'tid': threading.current_thread().ident,
+                           'args': args})
+        return False
+
+
+_tracer = None
+
+
+def enabled():
+    return _tracer is not None
+
+
+def path():
+    """ the file spans are written to, None while tracing is off """
+    return _tracer.path if _tracer is not None else None
+
+
+def enable(path):
+    """ start writing spans to ``path`` """
+    global _tracer
+    disable()
+    _tracer = Tracer(path)
+
+
+def disable():
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+
+
+def span(name, **attributes):
+    """
+    A span for ``with``. Attributes are shown with the span in the trace,
+    more can be added with ``set``.
+    """
+    if _tracer is None:
+        return NOOP
+    return Span(_tracer, name, attributes)
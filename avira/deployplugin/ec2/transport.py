@@ -0,0 +1,186 @@
+"""
+Record and replay EC2/VPC API traffic.
+
+Both hook into ``make_request`` of a boto connection, which every EC2 and
+VPC call goes through. The recorder writes each request and its response
+as a json line. Requests are recorded before boto signs them, so no keys
+or signatures end up in the file; private keys and passwords in responses
+(CreateKeyPair, GetPasswordData) are blanked. The player serves those
+responses without any network, with the recorded latency, scaled, or none
+at all. This makes commands repeatable to benchmark offline.
+
+Enable them with environment variables::
+
+    AVIRA_EC2_RECORD=/tmp/session.jsonl
+    AVIRA_EC2_REPLAY=/tmp/session.jsonl
+    AVIRA_EC2_REPLAY_LATENCY=realistic|zero|<factor>
+"""
+import collections
+import json
+import os
+import re
+import threading
+import time
+from StringIO import StringIO
+
+__all__ = ('Recorder', 'Player', 'ReplayError', 'wrap_connections')
+
+RECORD_VARIABLE = 'AVIRA_EC2_RECORD'
+REPLAY_VARIABLE = 'AVIRA_EC2_REPLAY'
+LATENCY_VARIABLE = 'AVIRA_EC2_REPLAY_LATENCY'
+
+# parameters which are never written to a recording
+SECRET_PARAMS = ('AWSAccessKeyId', 'Signature', 'SignatureMethod',
+                 'SignatureVersion', 'SecurityToken', 'X-Amz-Security-Token',
+                 'X-Amz-Credential', 'X-Amz-Signature')
+
+# response elements which hold secrets
+SECRET_ELEMENTS = re.compile(r'<(keyMaterial|passwordData)>.*?</\1>', re.S)
+
+# parameters which differ between otherwise equal requests
+VOLATILE_PARAMS = ('ClientToken', 'Timestamp', 'Expires', 'X-Amz-Date')
+
+
+class ReplayError(Exception):
+    """ There is no recorded response for a request """
+
+
+class ReplayResponse(object):
+    """ Stands in for the httplib response boto reads """
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._body = StringIO(body)
+
+    def read(self, amt=None):
+        return self._body.read() if amt is None else self._body.read(amt)
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def getheaders(self):
+        return self.headers.items()
+
+
+def _scrub(params):
+    return dict((k, v) for k, v in (params or {}).items()
+                if k not in SECRET_PARAMS)
+
+
+def _redact(body):
+    return SECRET_ELEMENTS.sub(r'<\1>REDACTED</\1>', body)
+
+
+def _key(host, action, params):
+    params = tuple(sorted((k, v) for k, v in params.items()
+                          if k not in VOLATILE_PARAMS))
+    return host, action, params
+
+
+class Recorder(object):
+    """ Append the traffic of wrapped connections to a file """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def wrap(self, connection):
+        original = connection.make_request
+        host = connection.host
+
+        def make_request(action, params=None, path='/', verb='GET',
+                         *args, **kwargs):
+            start = time.time()
+            response = original(action, params, path, verb, *args, **kwargs)
+            body = response.read()
+            elapsed = time.time() - start
+            headers = dict((k.lower(), v) for k, v in response.getheaders())
+            entry = {'host': host, 'action': action, 'verb': verb,
+                     'path': path, 'params': _scrub(params),
+                     'status': response.status, 'reason': response.reason,
+                     'headers': headers, 'body': _redact(body),
+                     'elapsed': elapsed}
+            with self._lock:
+                self._file.write(json.dumps(entry) + '\n')
+                self._file.flush()
+            return ReplayResponse(response.status, response.reason, headers,
+                                  body)
+
+        connection.make_request = make_request
+        return connection
+
+
+class Player(object):
+    """
+    Serve recorded responses. Equal requests get their recorded responses
+    in order, the last one is repeated once they run out (e.g. polling).
+
+    ``latency`` is 'realistic' (the recorded time), 'zero', or a factor for
+    the recorded time.
+    """
+
+    def __init__(self, path, latency='realistic'):
+        self.path = path
+        if latency == 'realistic':
+            self.factor = 1.0
+        elif latency == 'zero':
+            self.factor = 0.0
+        else:
+            self.factor = float(latency)
+        self.responses = collections.defaultdict(collections.deque)
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                key = _key(entry['host'], entry['action'], entry['params'])
+                self.responses[key].append(entry)
+        self._lock = threading.Lock()
+
+    def _next(self, key):
+        with self._lock:
+            queue = self.responses.get(key)
+            if not queue:
+                return None
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def wrap(self, connection):
+        host = connection.host
+
+        def make_request(action, params=None, path='/', verb='GET',
+                         *args, **kwargs):
+            entry = self._next(_key(host, action, _scrub(params)))
+            if entry is None:
+                raise ReplayError("no recorded response for %s %s" %
+                                  (action, sorted((params or {}).items())))
+            if self.factor:
+                time.sleep(entry['elapsed'] * self.factor)
+            return ReplayResponse(entry['status'], entry['reason'],
+                                  entry['headers'],
+                                  entry['body'].encode('utf-8'))
+
+        connection.make_request = make_request
+        return connection
+
+
+_transport = None
+
+
+def wrap_connections(*connections):
+    """
+    Record or replay the traffic of the connections when the environment
+    asks for it. All connections of a process share one recorder/player.
+    """
+    global _transport
+    if _transport is None:
+        if os.environ.get(REPLAY_VARIABLE):
+            _transport = Player(os.environ[REPLAY_VARIABLE],
+                                os.environ.get(LATENCY_VARIABLE, 'realistic'))
+        elif os.environ.get(RECORD_VARIABLE):
+            _transport = Recorder(os.environ[RECORD_VARIABLE])
+        else:
+            return connections
+    return tuple(_transport.wrap(c) for c in connections)
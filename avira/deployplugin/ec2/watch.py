@@ -0,0 +1,43 @@
+"""
+State transitions between two polls of a set of instances.
+"""
+import re
+
+__all__ = ('transitions', 'missing_instances')
+
+NEW = 'new'
+CHANGED = 'changed'
+GONE = 'gone'
+
+
+def transitions(previous, current):
+    """
+    Compare two ``{instance_id: record}`` dicts and return a list of
+    ``(kind, instance_id, old_state, new_state, record)`` tuples, where kind
+    is NEW, CHANGED or GONE. Unchanged instances are left out.
+    """
+    changes = []
+    for instance_id, record in current.items():
+        old = previous.get(instance_id)
+        if old is None:
+            changes.append((NEW, instance_id, None, record.state, record))
+        elif old.state != record.state:
+            changes.append((CHANGED, instance_id, old.state, record.state,
+                            record))
+    for instance_id, record in previous.items():
+        if instance_id not in current:
+            changes.append((GONE, instance_id, record.state, None, record))
+    changes.sort(key=lambda c: c[1])
+    return changes
+
+
+def missing_instances(error, instance_ids):
+    """
+    The selected instance ids an ``InvalidInstanceID.NotFound`` error names,
+    e.g. terminated instances which aged out. Empty for any other error.
+    """
+    if not instance_ids or \
+            not (error.error_code or '').startswith('InvalidInstanceID.NotFound'):
+        return set()
+    named = set(re.findall(r'i-[0-9a-f]+', error.error_message or ''))
+    return named & set(instance_ids)
@@ -0,0 +1,135 @@
+"""
+Compare the boto DescribeInstances parsing (what ``get_all_instances``
+does with a response) with the incremental parser of the ``fast`` path.
+
+Usage::
+
+    python benchmarks/describe_instances.py [response.xml ...]
+
+Pass recorded DescribeInstances responses, without arguments a response
+with 5000 instances is generated.
+"""
+import sys
+import time
+import xml.sax
+
+from boto.ec2.instance import Reservation
+from boto.handler import XmlHandler
+from boto.resultset import ResultSet
+
+from avira.deployplugin.ec2.describe import parse_chunks, CHUNK_SIZE
+
+RUNS = 5
+
+INSTANCE = """
+        <item>
+          <instanceId>i-%(n)08x</instanceId>
+          <imageId>ami-c1aaabb5</imageId>
+          <instanceState><code>16</code><name>running</name></instanceState>
+          <privateDnsName>ip-10-0-%(a)d-%(b)d.eu-west-1.compute.internal</privateDnsName>
+          <dnsName></dnsName>
+          <reason/>
+          <keyName>ssh_key</keyName>
+          <amiLaunchIndex>0</amiLaunchIndex>
+          <productCodes/>
+          <instanceType>m1.large</instanceType>
+          <launchTime>2013-01-01T00:00:00.000Z</launchTime>
+          <placement><availabilityZone>eu-west-1a</availabilityZone><groupName/><tenancy>default</tenancy></placement>
+          <kernelId>aki-62695816</kernelId>
+          <monitoring><state>disabled</state></monitoring>
+          <subnetId>subnet-%(s)d</subnetId>
+          <vpcId>vpc-%(v)d</vpcId>
+          <privateIpAddress>10.0.%(a)d.%(b)d</privateIpAddress>
+          <sourceDestCheck>true</sourceDestCheck>
+          <groupSet><item><groupId>sg-1</groupId><groupName>default</groupName></item></groupSet>
+          <architecture>x86_64</architecture>
+          <rootDeviceType>ebs</rootDeviceType>
+          <rootDeviceName>/dev/sda1</rootDeviceName>
+          <blockDeviceMapping>
+            <item><deviceName>/dev/sda1</deviceName><ebs><volumeId>vol-%(n)08x</volumeId><status>attached</status><attachTime>2013-01-01T00:00:00.000Z</attachTime><deleteOnTermination>true</deleteOnTermination></ebs></item>
+          </blockDeviceMapping>
+          <virtualizationType>paravirtual</virtualizationType>
+          <tagSet>
+            <item><key>Name</key><value>machine%(n)d</value></item>
+            <item><key>Role</key><value>role%(r)d</value></item>
+          </tagSet>
+          <hypervisor>xen</hypervisor>
+          <networkInterfaceSet>
+            <item><networkInterfaceId>eni-%(n)08x</networkInterfaceId><subnetId>subnet-%(s)d</subnetId><vpcId>vpc-%(v)d</vpcId>
+              <privateIpAddressesSet><item><privateIpAddress>10.0.%(a)d.%(b)d</privateIpAddress><primary>true</primary></item></privateIpAddressesSet>
+            </item>
+          </networkInterfaceSet>
+          <ebsOptimized>false</ebsOptimized>
+        </item>"""
+
+
+def generate(count):
+    items = []
+    for n in range(count):
+        items.append("""
+    <item>
+      <reservationId>r-%(n)08x</reservationId>
+      <ownerId>123456789012</ownerId>
+      <groupSet/>
+      <instancesSet>%(instance)s
+      </instancesSet>
+    </item>""" % {'n': n, 'instance': INSTANCE % {'n': n,
+                                                  'a': n // 256 % 256,
+                                                  'b': n % 256,
+                                                  's': n % 8,
+                                                  'v': n % 3,
+                                                  'r': n % 12}})
+    return """<?xml version="1.0" encoding="UTF-8"?>
+<DescribeInstancesResponse xmlns="http://ec2.amazonaws.com/doc/2012-12-01/">
+  <requestId>00000000-0000-0000-0000-000000000000</requestId>
+  <reservationSet>%s
+  </reservationSet>
+</DescribeInstancesResponse>""" % "".join(items)
+
+
+def boto_path(body):
+    rs = ResultSet([('item', Reservation)])
+    xml.sax.parseString(body, XmlHandler(rs, None))
+    return [i for r in rs for i in r.instances]
+
+
+def fast_path(body):
+    chunks = (body[n:n + CHUNK_SIZE] for n in range(0, len(body), CHUNK_SIZE))
+    return list(parse_chunks(chunks))
+
+
+def first_row(body):
+    chunks = (body[n:n + CHUNK_SIZE] for n in range(0, len(body), CHUNK_SIZE))
+    for record in parse_chunks(chunks):
+        return record
+
+
+def best(func, body):
+    timings = []
+    for _ in range(RUNS):
+        start = time.time()
+        result = func(body)
+        timings.append(time.time() - start)
+    return min(timings), result
+
+
+def main(paths):
+    if paths:
+        bodies = [(p, open(p).read()) for p in paths]
+    else:
+        bodies = [("generated", generate(5000))]
+
+    for name, body in bodies:
+        boto_time, instances = best(boto_path, body)
+        fast_time, records = best(fast_path, body)
+        first_time, _ = best(first_row, body)
+        assert [i.id for i in instances] == [r.id for r in records]
+        print "%s: %d instances, %d KB" % (name, len(records), len(body) // 1024)
+        print "  get_all_instances parse  %8.3fs" % boto_time
+        print "  incremental parse        %8.3fs (%.1fx)" % (
+            fast_time, boto_time / fast_time)
+        print "  first row                %8.3fs" % first_time
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,74 @@
+"""
+Import-time regression check for the plugin package.
+
+Loading the plugin (to read its config template or to list plugins) must
+not pull in boto or the avira.deploy helpers, and has to stay within a
+time budget.
+
+The ``avira`` namespace package is imported first and is not counted: its
+pkg_resources namespace declaration loads modules (e.g. pprint) and takes
+time the plugin has no say in.
+
+Usage::
+
+    python benchmarks/import_time.py [budget in seconds]
+
+Exits with 1 when a heavy module got imported or the budget is exceeded.
+"""
+import subprocess
+import sys
+
+RUNS = 10
+BUDGET = 0.25
+
+# modules which may only be loaded by the commands which use them
+HEAVY = ('boto', 'boto.ec2', 'boto.vpc', 'pprint', 'json', 'xml.sax',
+         'cProfile', 'avira.deploy.clean', 'avira.deploy.certificate',
+         'avira.deploy.userdata', 'avira.deployplugin.ec2.describe',
+         'avira.deployplugin.ec2.pipeline', 'avira.deployplugin.ec2.inventory')
+
+SCRIPT = """
+import sys, time
+import avira
+baseline = set(m for m in sys.modules if sys.modules[m] is not None)
+start = time.time()
+import avira.deployplugin.ec2
+elapsed = time.time() - start
+print elapsed
+print ' '.join(m for m in %r
+               if sys.modules.get(m) is not None and m not in baseline)
+""" % (HEAVY,)
+
+
+def measure():
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT])
+    lines = output.splitlines()
+    loaded = lines[1].split() if len(lines) > 1 else []
+    return float(lines[0]), loaded
+
+
+def main(args):
+    budget = float(args[0]) if args else BUDGET
+    timings = []
+    loaded = set()
+    for _ in range(RUNS):
+        elapsed, modules = measure()
+        timings.append(elapsed)
+        loaded.update(modules)
+    timings.sort()
+    median = timings[len(timings) // 2]
+    print "import avira.deployplugin.ec2 after avira: median %.3fs, best %.3fs (budget %.3fs)" % (
+        median, timings[0], budget)
+
+    failed = False
+    if loaded:
+        print "heavy modules loaded at import: %s" % ", ".join(sorted(loaded))
+        failed = True
+    if median > budget:
+        print "import time over budget"
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,51 @@
+"""
+Benchmark provider commands against a recorded session, without network.
+
+Record a session first::
+
+    AVIRA_EC2_RECORD=/tmp/session.jsonl <deploy tool, using the ec2 provider>
+
+then time commands against it::
+
+    python benchmarks/replay.py /tmp/session.jsonl "list instances" "summary vpc_id"
+
+The recorded latencies are used by default, set AVIRA_EC2_REPLAY_LATENCY
+to 'zero' to only measure our own code, or to a factor to scale them.
+"""
+import os
+import sys
+import time
+
+RUNS = 5
+
+
+def main(args):
+    if len(args) < 2:
+        print __doc__
+        return 1
+    os.environ['AVIRA_EC2_REPLAY'] = args[0]
+    os.environ.pop('AVIRA_EC2_RECORD', None)
+
+    from avira.deployplugin.ec2.provider import Provider
+    provider = Provider()
+
+    print "{0:<30}\t{1:<10}\t{2:<10}\t{3}".format("Command", "Best (s)", "Median (s)", "Worst (s)")
+    for line in args[1:]:
+        timings = []
+        for _ in range(RUNS):
+            stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+            start = time.time()
+            try:
+                provider.onecmd(line)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            timings.append(time.time() - start)
+        timings.sort()
+        print "{0:<30}\t{1:<10.3f}\t{2:<10.3f}\t{3:.3f}".format(
+            line, timings[0], timings[len(timings) // 2], timings[-1])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))